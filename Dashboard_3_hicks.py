@@ -4,16 +4,27 @@ from dash import dcc, html
 from dash.dependencies import Input, Output, State, ALL
 import plotly.express as px
 import pandas as pd
+from dash_profiling import phase, profile_app
+from data_server import int_year, load_table
+from gdp_index import GapminderIndex
+from static_export import StaticFigures
 
-# Load sample data
-df_gdp = pd.read_pickle('data_gapminder.pkl')
+# Load sample data (only the columns used, from the columnar store written by data_prep.ipynb),
+# with the year converted to int. DASH_SHARED_DATA=1 shares one copy between all workers
+df_gdp = load_table('data_gapminder', columns=['year', 'continent', 'country', 'gdpPercap', 'lifeExp', 'pop'], prepare=int_year)
 
-# turn year into a float
-df_gdp['year'] = df_gdp['year'].astype(int)
+# row positions per year / continent / country, all callbacks filter through this
+gdp_index = GapminderIndex(df_gdp)
+
+# pre-rendered figures of static_export.py, served when started with STATIC_FIGURES_DIR=export
+static_figures = StaticFigures('Dashboard_3_hicks')
 
 # Create a Dash app
 app = dash.Dash(__name__)
 
+# callback timings on /metrics when started with DASH_PROFILE=1
+profile_app(app)
+
 # Define the layout
 app.layout = html.Div([
     html.H1('Gapminder Visualization'),
@@ -33,8 +44,8 @@ app.layout = html.Div([
      Output('continent-buttons', 'children')],
     [Input('graph', 'figure')])
 def create_buttons(_):
-    year_buttons = [html.Button(year, id={'type': 'year-button', 'index': year}, n_clicks=0) for year in df_gdp['year'].unique()]
-    continent_buttons = [html.Button(continent, id={'type': 'continent-button', 'index': continent}, n_clicks=0) for continent in df_gdp['continent'].unique()]
+    year_buttons = [html.Button(year, id={'type': 'year-button', 'index': year}, n_clicks=0) for year in gdp_index.years()]
+    continent_buttons = [html.Button(continent, id={'type': 'continent-button', 'index': continent}, n_clicks=0) for continent in gdp_index.continents()]
     return year_buttons, continent_buttons
 
 # Define the callback for updating the graph
@@ -45,8 +56,8 @@ def create_buttons(_):
 def update_figure(year_clicks, continent_clicks):
     ctx = dash.callback_context
     if not ctx.triggered:
-        year_value = df_gdp['year'].min()
-        continent_value = df_gdp['continent'].unique()[0]
+        year_value = gdp_index.years().min()
+        continent_value = gdp_index.continents()[0]
     else:
         button_id = ctx.triggered[0]['prop_id'].split('.')[0]
         button_id = eval(button_id)  # Convert string representation back to dictionary
@@ -54,14 +65,21 @@ def update_figure(year_clicks, continent_clicks):
         button_value = button_id['index']
         if button_type == 'year-button':
             year_value = float(button_value)
-            continent_value = df_gdp['continent'].unique()[0]  # Default continent
+            continent_value = gdp_index.continents()[0]  # Default continent
         elif button_type == 'continent-button':
-            year_value = df_gdp['year'].min()  # Default year
+            year_value = gdp_index.years().min()  # Default year
             continent_value = button_value
+    return scatter_figure(year_value, continent_value)
+
 
-    filtered_df = df_gdp[(df_gdp['year'] == year_value) & (df_gdp['continent'] == continent_value)]
-    fig = px.scatter(filtered_df, x="gdpPercap", y="lifeExp", size="pop", color="continent", hover_name="country", size_max=60)
-    fig.update_layout(transition_duration=500)
+# the figure of one year / continent, apart from the button bookkeeping so it can be pre-rendered
+@static_figures.prerendered
+def scatter_figure(year_value, continent_value):
+    with phase('filter'):
+        filtered_df = gdp_index.select(year_value, continent_value)
+    with phase('figure'):
+        fig = px.scatter(filtered_df, x="gdpPercap", y="lifeExp", size="pop", color="continent", hover_name="country", size_max=60)
+        fig.update_layout(transition_duration=500)
     return fig
 
 # Define the callback for displaying the selected year and continent
@@ -1,24 +1,67 @@
 # Import necessary libraries
+import os
 import dash
 from dash import dcc
 from dash import html
 import plotly.express as px
 import pandas as pd
+from dash import ClientsideFunction
 from dash.dependencies import Input, Output, State
+from dash_profiling import phase, profile_app
+from data_server import int_year, load_table
+from data_store import table_path
+from figure_cache import FigureCache, neighbors
+from gdp_clientside import clientside_enabled, encode_columns, register_payload, skip_callback
+from gdp_index import GapminderIndex
+from map_patch import DEFAULT_LINE, ChoroplethMap, patch_enabled
+from static_export import StaticFigures
 
-# Load sample data
-df_gdp = pd.read_pickle('data_gapminder_join.pkl')
+# Load sample data (only the columns used, from the columnar store written by data_prep.ipynb),
+# with the year converted to int. DASH_SHARED_DATA=1 shares one copy between all workers
+df_gdp = load_table('data_gapminder_join', columns=['year', 'continent', 'country', 'alpha-3', 'gdpPercapita', 'population', 'lifeExpectancy'], prepare=int_year)
 
-# convert year to int
-df_gdp.year = df_gdp.year.astype(int)
+# row positions per year / continent / country, all callbacks filter through this
+gdp_index = GapminderIndex(df_gdp)
+
+# rendered figures by callback inputs, rebuilt when the data in the store changes
+# (set FIGURE_CACHE_DIR to share them between Gunicorn workers)
+figure_cache = FigureCache(maxsize=512, watch=[table_path('data_gapminder_join')])
+
+# pre-rendered figures of static_export.py, served when started with STATIC_FIGURES_DIR=export
+static_figures = StaticFigures('Dashboard_LE4_fast')
+
+# one choropleth over every country, sent once with the map page and then patched per year
+MAP_PATCH = patch_enabled()
+world_map = ChoroplethMap(df_gdp, 'alpha-3', 'gdpPercapita', hover_name='country',
+                          hover_data={'alpha-3': False, 'country': None, 'gdpPercapita': ':.2f', 'population': None, 'lifeExpectancy': ':.1f'})
+
+
+def adjacent_years(selected_year, *rest):
+    # the slider nearly always moves to a neighbouring year, warm those figures in the background
+    return [(year, *rest) for year in neighbors(gdp_index.years(), selected_year)] if selected_year is not None else []
+
+
+def adjacent_map_years(pathname, selected_country, selected_year, data):
+    if pathname != '/map' or selected_year is None:
+        return []
+    return [(pathname, selected_country, year, data) for year in neighbors(gdp_index.years(), selected_year)]
 
 # Create a Dash app
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
 
+# callback timings on /metrics when started with DASH_PROFILE=1
+profile_app(app)
+
+# With DASH_CLIENTSIDE=1 df_gdp is sent to the browser once per session (gdp-data store) and
+# filters / figures run in assets/gapminder_clientside.js, the server callbacks below stay unregistered
+CLIENTSIDE = clientside_enabled()
+server_callback = skip_callback if CLIENTSIDE else app.callback
+
 # Define the layout with a location component and a content div
 app.layout = html.Div([
     dcc.Location(id='url', refresh=False),
     dcc.Store(id='shared-data', storage_type='session'),
+    dcc.Store(id='gdp-data', storage_type='session'),
     html.Div([
         html.Div([
             html.H2("Menu", style={'text-align': 'center'}),
@@ -43,7 +86,7 @@ app.layout = html.Div([
     html.Div(id='page-content', style={'marginLeft': '20%', 'width': '80%'})
 ])
 
-@app.callback(
+@server_callback(
     Output('shared-data', 'data'),
     [Input('year-slider', 'value')],
     [State('shared-data', 'data')])
@@ -53,191 +96,267 @@ def update_store(selected_year, data):
     data['selected_year'] = selected_year
     return data
 
+# Page skeletons, built once at startup instead of on every callback. Selection changes only
+# update the properties that depend on them (figures, country options), the year slider keeps
+# its value across page switches through Dash persistence
+year_marks = {str(year): str(year) for year in gdp_index.years()}
+
+
+def make_year_slider():
+    return dcc.Slider(
+        id='year-slider',
+        min=gdp_index.years().min(),
+        max=gdp_index.years().max(),
+        value=gdp_index.years().max(),
+        marks=year_marks,
+        step=None,
+        persistence=True,
+        persistence_type='session'
+    )
+
+
+# Map layout shared by both map modes
+MAP_LAYOUT = dict(
+    coloraxis_colorbar=dict(
+        thickness=10,  # Adjust the thickness of the color bar (in pixels)
+        len=0.3,  # Adjust the length of the color bar (fraction of the plot height)
+        title='GDP per Capita',  # Color bar title
+        titleside='right'
+    ),
+    transition_duration=500,
+    width=1000,  # Set the width of the map
+    height=1000,
+    margin=dict(l=0, r=0, t=0, b=0, autoexpand=True) # Set the height of the map
+)
+
+# base figure of the map page, already showing the latest year
+map_base = world_map.base(gdp_index.select(gdp_index.years().max()), **MAP_LAYOUT) if MAP_PATCH else {}
+
+# Map page content
+map_page = html.Div([
+        html.H1("Gapminder Map", style={'text-align': 'center'}),
+        html.Div([  # Container for the filters
+            html.Div([  # Container for the year slider
+                html.Div([
+                    html.Label("Select a year:"),
+                    make_year_slider()
+                ], style={'width': '90%', 'margin': '20px auto'})
+            ], style={'width': '50%', 'display': 'inline-block', 'margin-right': '10px'}),  # Set to 50% width and inline-block for side-by-side display
+            html.Div([  # Container for the dropdown
+                dcc.Dropdown(
+                    id='country-search-dropdown',
+                    options=[{'label': country, 'value': country} for country in gdp_index.countries()],
+                    placeholder="Select a country",)
+            ], style={'width': '50%', 'display': 'inline-block'}),  # Set to 50% width and inline-block for side-by-side display
+        ], style={'display': 'flex', 'justify-content': 'center', 'align-items': 'center'}),  # This will ensure the filters are centered and flexibly aligned
+        html.Div([
+            dcc.Graph(id='map-graph', figure=map_base, style={'height': 'auto', 'width': '70%'}),
+        ],  style={'margin-left': 'auto', 'margin-right': 'auto', 'margnin-top': '-20px', 'display': 'flex', 'justify-content': 'center', 'align-items': 'center', 'height': '100%'}),   # This will center the map in the div
+    ], style={'height': '100vh', 'overflow': 'hidden'})
+
+# Home page content (default page)
+home_page = html.Div([
+        html.H1("Gapminder Dataset", style={'text-align': 'center', 'margin-bottom': '20px'}),
+        html.Div([
+            html.Div([
+                html.Label("Select a year:"),
+                make_year_slider(),
+            ], style={'width': '30%', 'display': 'inline-block'}),
+            html.Div([
+                html.Label("Select a continent:"),
+                dcc.Dropdown(
+                    id='continent-dropdown',
+                    options=[{'label': continent, 'value': continent} for continent in gdp_index.continents()],
+                    value=gdp_index.continents()[0]
+                ),
+            ], style={'width': '30%', 'display': 'inline-block'}),
+            html.Div([
+                html.Label("Select a country:"),
+                dcc.Dropdown(
+                        id='country-search-dropdown',  # Note the updated id here
+                        options=[],  # Initially empty, will be populated via callback
+                        placeholder="Select a country",
+                ),
+            ], style={'width': '30%', 'display': 'inline-block'}),
+        ], style={'display': 'flex', 'justify-content': 'space-around', 'align-items': 'center', 'margin-bottom': '20px'}),
+        html.Div([
+            dcc.Graph(id='graph', style={'display': 'inline-block', 'width': '49%'}),
+            dcc.Graph(id='bar-chart', style={'display': 'inline-block', 'width': '49%'}),
+        ], style={'display': 'flex'}),
+    ])
+
+# Only the url switches pages, the year is no longer an input here, so moving the slider
+# does not rebuild and remount the page
 @app.callback(
     Output('page-content', 'children'),
-    [Input('url', 'pathname'),
-     Input('shared-data', 'data')])
-def display_page(pathname, data):
-    selected_year = data.get('selected_year', df_gdp['year'].max()) if data else df_gdp['year'].max()
-    year_slider = html.Div([
-        html.Label("Select a year:"),
-        dcc.Slider(
-            id='year-slider',
-            min=df_gdp['year'].min(),
-            max=df_gdp['year'].max(),
-            value=selected_year,
-            marks={str(year): str(year) for year in df_gdp['year'].unique()},
-            step=None
-        )
-    ], style={'width': '90%', 'margin': '20px auto'})
-
+    [Input('url', 'pathname')])
+def display_page(pathname):
     if pathname == '/map':
-        # Map page content
-        return html.Div([
-                html.H1("Gapminder Map", style={'text-align': 'center'}),
-                html.Div([  # Container for the filters
-                    html.Div([  # Container for the year slider
-                        year_slider
-                    ], style={'width': '50%', 'display': 'inline-block', 'margin-right': '10px'}),  # Set to 50% width and inline-block for side-by-side display
-                    html.Div([  # Container for the dropdown
-                        dcc.Dropdown(
-                            id='country-search-dropdown',
-                            options=[{'label': country, 'value': country} for country in df_gdp['country'].unique()],
-                            placeholder="Select a country",)
-                    ], style={'width': '50%', 'display': 'inline-block'}),  # Set to 50% width and inline-block for side-by-side display
-                ], style={'display': 'flex', 'justify-content': 'center', 'align-items': 'center'}),  # This will ensure the filters are centered and flexibly aligned
-                html.Div([
-                    dcc.Graph(id='map-graph', style={'height': 'auto', 'width': '70%'}),
-                ],  style={'margin-left': 'auto', 'margin-right': 'auto', 'margnin-top': '-20px', 'display': 'flex', 'justify-content': 'center', 'align-items': 'center', 'height': '100%'}),   # This will center the map in the div
-            ], style={'height': '100vh', 'overflow': 'hidden'})
-    else:
-        # Home page content (default page)
-        return html.Div([
-                html.H1("Gapminder Dataset", style={'text-align': 'center', 'margin-bottom': '20px'}),
-                html.Div([
-                    html.Div([
-                        html.Label("Select a year:"),
-                        dcc.Slider(
-                            id='year-slider',
-                            min=df_gdp['year'].min(),
-                            max=df_gdp['year'].max(),
-                            value=selected_year,
-                            marks={str(year): str(year) for year in df_gdp['year'].unique()},
-                            step=None
-                        ),
-                    ], style={'width': '30%', 'display': 'inline-block'}),
-                    html.Div([
-                        html.Label("Select a continent:"),
-                        dcc.Dropdown(
-                            id='continent-dropdown',
-                            options=[{'label': continent, 'value': continent} for continent in df_gdp['continent'].unique()],
-                            value=df_gdp['continent'].unique()[0]
-                        ),
-                    ], style={'width': '30%', 'display': 'inline-block'}),
-                    html.Div([
-                        html.Label("Select a country:"),
-                        dcc.Dropdown(
-                                id='country-search-dropdown',  # Note the updated id here
-                                options=[],  # Initially empty, will be populated via callback
-                                placeholder="Select a country",
-                        ),
-                    ], style={'width': '30%', 'display': 'inline-block'}),
-                ], style={'display': 'flex', 'justify-content': 'space-around', 'align-items': 'center', 'margin-bottom': '20px'}),
-                html.Div([
-                    dcc.Graph(id='graph', style={'display': 'inline-block', 'width': '49%'}),
-                    dcc.Graph(id='bar-chart', style={'display': 'inline-block', 'width': '49%'}),
-                ], style={'display': 'flex'}),
-            ])
+        return map_page
+    return home_page
 
 # Callback to update the country dropdown based on the selected continent
-@app.callback(
+@server_callback(
     Output('country-search-dropdown', 'options'),
     [Input('continent-dropdown', 'value')])
 def update_country_dropdown(selected_continent):
     if selected_continent is not None:
-        filtered_countries = df_gdp[df_gdp['continent'] == selected_continent]['country'].unique()
+        filtered_countries = gdp_index.countries(selected_continent)
         return [{'label': country, 'value': country} for country in filtered_countries]
     return []
 
 
-# Define the callback for the map-graph - assuming you only want to show it on the map page
-@app.callback(
+def map_rows(selected_year, selected_country):
+    selected_year = int(selected_year) if selected_year is not None else gdp_index.years().max()
+    # Assuming you want to display the latest year's data on the map
+    df_filtered = gdp_index.select(selected_year)
+
+    if selected_country is not None and len(gdp_index.positions(selected_year, country=selected_country)):
+        df_filtered = gdp_index.select(selected_year, country=selected_country)
+    return df_filtered
+
+
+# Define the callback for the map-graph - assuming you only want to show it on the map page.
+# By default the map page already holds the base figure and the callback only sends the
+# values of the selected year as a Patch, DASH_MAP_MODE=full builds the complete figure per call
+@server_callback(
     Output('map-graph', 'figure'),
     [Input('url', 'pathname'),
      Input('country-search-dropdown', 'value'),
      Input('year-slider', 'value')],
      [State('shared-data', 'data')])  # The shared data store is also a state)
 def update_map(pathname, selected_country, selected_year, data):
-    if pathname == '/map':
-        selected_year = int(selected_year) if selected_year is not None else df_gdp['year'].max()
-        # Assuming you want to display the latest year's data on the map
-        df_filtered = df_gdp[df_gdp['year'] == selected_year]
+    if not MAP_PATCH:
+        return map_figure(pathname, selected_country, selected_year, data)
+    if pathname != '/map':
+        return dash.no_update
+    with phase('filter'):
+        df_filtered = map_rows(selected_year, selected_country)
+    with phase('figure'):
+        selected = selected_country is not None and selected_country in set(df_filtered['country'])
+        patch = world_map.patch(df_filtered, marker_line={'width': 3, 'color': 'gold'} if selected else DEFAULT_LINE)
+        if selected:
+            gdp = df_filtered['gdpPercapita'].iloc[0]
+            patch['layout']['annotations'] = [dict(text=f"{selected_country}: {gdp:.2f}", xref='paper', yref='paper',
+                                                   x=0.5, y=0.95, showarrow=False)]
+        else:
+            patch['layout']['annotations'] = []
+    return patch
 
-        if selected_country in df_filtered['country'].unique():
-            df_filtered = df_filtered[df_filtered['country'] == selected_country]
 
-        
+@static_figures.prerendered(key_args=(0, 1, 2))
+@figure_cache.cached(key_args=(0, 1, 2), prefetch=adjacent_map_years)  # the shared data does not change the map
+def map_figure(pathname, selected_country, selected_year, data):
+    if pathname == '/map':
+        with phase('filter'):
+            df_filtered = map_rows(selected_year, selected_country)
+
+        with phase('figure'):
+            # Create the map figure
+            map_fig = px.choropleth(df_filtered, locations='alpha-3', hover_name='country', color='gdpPercapita',
+                                    color_continuous_scale=px.colors.sequential.Plasma,
+                                     hover_data={
+                                                'alpha-3': False,  # Hide ISO code
+                                                'country': True,  # Display the country name
+                                                'gdpPercapita': ':.2f',  # Display GDP per capita with 2 decimal places
+                                                'population': True,  # Display population
+                                                'lifeExpectancy': ':.1f'
+                                                # Add other data columns here if you want them in the tooltip
+                                            })
 
-        # Create the map figure
-        map_fig = px.choropleth(df_filtered, locations='alpha-3', hover_name='country', color='gdpPercapita',
-                                color_continuous_scale=px.colors.sequential.Plasma,
-                                 hover_data={
-                                            'alpha-3': False,  # Hide ISO code
-                                            'country': True,  # Display the country name
-                                            'gdpPercapita': ':.2f',  # Display GDP per capita with 2 decimal places
-                                            'population': True,  # Display population
-                                            'lifeExpectancy': ':.1f'
-                                            # Add other data columns here if you want them in the tooltip
-                                        })
-
-        if selected_country:
-            map_fig.update_traces(marker_line_width=3, marker_line_color='gold')  # Highlight with a gold outline
+            if selected_country:
+                map_fig.update_traces(marker_line_width=3, marker_line_color='gold')  # Highlight with a gold outline
             
-            country_code = df_filtered[df_filtered['country'] == selected_country]['alpha-3'].iloc[0]
-            # Add an annotation
-            map_fig.add_annotation(
-                x=country_code,
-                y=country_code,
-                text=f"{selected_country}: {df_filtered['gdpPercap']}",  # Customize with the data you want to show
-                showarrow=True,
-                arrowhead=1
-            )
+                country_code = df_filtered[df_filtered['country'] == selected_country]['alpha-3'].iloc[0]
+                # Add an annotation
+                map_fig.add_annotation(
+                    x=country_code,
+                    y=country_code,
+                    text=f"{selected_country}: {df_filtered['gdpPercapita'].iloc[0]:.2f}",  # Customize with the data you want to show
+                    showarrow=True,
+                    arrowhead=1
+                )
 
-        
-        # Update color bar size
-        map_fig.update_layout(
-            coloraxis_colorbar=dict(
-                thickness=10,  # Adjust the thickness of the color bar (in pixels)
-                len=0.3,  # Adjust the length of the color bar (fraction of the plot height)
-                title='GDP per Capita',  # Color bar title
-                titleside='right'
-            ),
-            transition_duration=500,
-            width=1000,  # Set the width of the map
-            height=1000,
-            margin=dict(l=0, r=0, t=0, b=0, autoexpand=True) # Set the height of the map
-            )
+            # Update color bar size
+            map_fig.update_layout(**MAP_LAYOUT)
         
         return map_fig
     return {}
 
 
-@app.callback(
+@server_callback(
     Output('graph', 'figure'),
     [Input('year-slider', 'value'),
     Input('continent-dropdown', 'value'),
     Input('country-search-dropdown', 'value')])
+@static_figures.prerendered
+@figure_cache.cached(prefetch=adjacent_years)
 def update_scatter(selected_year, selected_continent, selected_country):
 
-    if selected_country is None:
-        filtered_df = df_gdp[(df_gdp['year'] == selected_year) & (df_gdp['continent'] == selected_continent)]
-    else:
-        filtered_df = df_gdp[(df_gdp['year'] == selected_year) & (df_gdp['continent'] == selected_continent) & (df_gdp['country'] == selected_country)]
+    with phase('filter'):
+        filtered_df = gdp_index.select(selected_year, selected_continent, selected_country)
 
-    scatter_fig = px.scatter(filtered_df, x='gdpPercapita', y='lifeExpectancy', size='population', hover_name='country', color='country')
-    scatter_fig.update_layout(transition_duration=500)
+    with phase('figure'):
+        scatter_fig = px.scatter(filtered_df, x='gdpPercapita', y='lifeExpectancy', size='population', hover_name='country', color='country')
+        scatter_fig.update_layout(transition_duration=500)
     return scatter_fig
 
 # Callback for bar chart
-@app.callback(
+@server_callback(
     Output('bar-chart', 'figure'),
     [Input('year-slider', 'value'),
     Input('continent-dropdown', 'value'),
     Input('country-search-dropdown', 'value')])
+@static_figures.prerendered
+@figure_cache.cached(prefetch=adjacent_years)
 def update_bar(selected_year, selected_continent, selected_country):
 
-    if selected_country is None:
-        filtered_df = df_gdp[(df_gdp['year'] == selected_year) & (df_gdp['continent'] == selected_continent)]
-    else:
-        filtered_df = df_gdp[(df_gdp['year'] == selected_year) & (df_gdp['continent'] == selected_continent) & (df_gdp['country'] == selected_country)]
+    with phase('filter'):
+        filtered_df = gdp_index.select(selected_year, selected_continent, selected_country)
    
-    bar_fig = px.bar(filtered_df, x='country', y='population')
-    bar_fig.update_layout(transition_duration=500)
+    with phase('figure'):
+        bar_fig = px.bar(filtered_df, x='country', y='population')
+        bar_fig.update_layout(transition_duration=500)
     return bar_fig
 
 # Define the callbacks for the scatterplot and bar chart as before
 # ...
 
+if CLIENTSIDE:
+    register_payload(app, 'gdp-data', encode_columns(df_gdp, df_gdp.columns, version=os.path.getmtime(table_path('data_gapminder_join'))))
+
+    app.clientside_callback(
+        ClientsideFunction('gapminder', 'le4Store'),
+        Output('shared-data', 'data'),
+        [Input('year-slider', 'value')],
+        [State('shared-data', 'data')])
+    app.clientside_callback(
+        ClientsideFunction('gapminder', 'le4Countries'),
+        Output('country-search-dropdown', 'options'),
+        [Input('continent-dropdown', 'value'),
+         Input('gdp-data', 'data')])
+    app.clientside_callback(
+        ClientsideFunction('gapminder', 'le4Map'),
+        Output('map-graph', 'figure'),
+        [Input('url', 'pathname'),
+         Input('country-search-dropdown', 'value'),
+         Input('year-slider', 'value'),
+         Input('gdp-data', 'data')])
+    app.clientside_callback(
+        ClientsideFunction('gapminder', 'le4Scatter'),
+        Output('graph', 'figure'),
+        [Input('year-slider', 'value'),
+         Input('continent-dropdown', 'value'),
+         Input('country-search-dropdown', 'value'),
+         Input('gdp-data', 'data')])
+    app.clientside_callback(
+        ClientsideFunction('gapminder', 'le4Bar'),
+        Output('bar-chart', 'figure'),
+        [Input('year-slider', 'value'),
+         Input('continent-dropdown', 'value'),
+         Input('country-search-dropdown', 'value'),
+         Input('gdp-data', 'data')])
+
 # Run the app
 if __name__ == '__main__':
     app.run_server(debug=True)
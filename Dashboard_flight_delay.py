@@ -0,0 +1,225 @@
+# Import necessary libraries
+import logging
+import os
+from functools import lru_cache, wraps
+
+import dash
+from dash import dcc
+from dash import html
+import plotly.express as px
+import plotly.graph_objects as go
+import numpy as np
+from dash.dependencies import Input, Output
+from dash_profiling import phase, profile_app
+from data_server import arrivals_by_time, load_table
+from data_store import table_path
+from downsample import downsample, point_budget, visible_range
+from flight_rollup import dest_counts
+from static_export import StaticFigures
+from time_pyramid import LEVELS, choose_level, pyramid_name, query, read_pyramid
+
+logger = logging.getLogger('Dashboard_flight_delay')
+
+# Load the arrival delays (only the columns used, from the columnar store written by data_prep.ipynb),
+# sorted once by time so every zoom is a binary search on the timestamps.
+# DASH_SHARED_DATA=1 shares one sorted copy between all workers
+flight_data_arr = load_table('flight_data_arr', columns=['ARR_DATETIME', 'ARR_DELAY', 'DEST'], prepare=arrivals_by_time)
+
+
+
+def destination_counts():
+    # from the rollups; a store ingested with flight_ingest.py --no-rollups has none, count the flights then
+    try:
+        return dest_counts()
+    except FileNotFoundError:
+        return flight_data_arr.groupby('DEST', observed=True)['DEST'].count().sort_values(ascending=True)
+
+
+# destinations ordered by number of flights, smallest first (as in LE1_performance.ipynb)
+flights_per_dest = destination_counts()
+
+# day / hour / 5-minute delay buckets (prep_pipeline.py / flight_ingest.py), the 'time pyramid'
+# mode picks the level that fits the zoom, so the whole range and a single hour cost the same
+# payload. The tables are read on first use; without them the mode is not offered
+PYRAMID_AVAILABLE = all(os.path.exists(table_path(pyramid_name('arr', level))) for level in LEVELS)
+if not PYRAMID_AVAILABLE:
+    logger.warning('no time pyramid in the store, run prep_pipeline.py or flight_ingest.py to build it')
+
+
+@lru_cache(maxsize=1)
+def load_pyramid():
+    # {level: table} and the first / last day bucket
+    pyramid = read_pyramid('arr')
+    return pyramid, (pyramid['day']['bucket'].iloc[0], pyramid['day']['bucket'].iloc[-1])
+
+
+# the zoomed-out figures pre-rendered by static_export.py, served when started with STATIC_FIGURES_DIR=export
+static_figures = StaticFigures('Dashboard_flight_delay')
+
+# the plot is this wide, the point budget is derived from it
+GRAPH_WIDTH = 1200
+SCENARIOS = {'Testszenario 1': 200, 'Testszenario 2': 250, 'Testszenario 3': 300, 'All destinations': None}
+
+
+@lru_cache(maxsize=len(SCENARIOS))
+def scenario_series(scenario):
+    # sorted x / y arrays of the smallest-N destinations of a test scenario
+    n_dest = SCENARIOS[scenario]
+    data = flight_data_arr
+    if n_dest is not None:
+        data = data[data['DEST'].isin(flights_per_dest.head(n_dest).index)]
+    return data['ARR_DATETIME'].values, data['ARR_DELAY'].values
+
+
+def zoom_range(relayout_data):
+    # x range of the current zoom, (None, None) when zoomed out
+    if not relayout_data or relayout_data.get('xaxis.autorange'):
+        return None, None
+    if 'xaxis.range[0]' in relayout_data:
+        return relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    if 'xaxis.range' in relayout_data:
+        return tuple(relayout_data['xaxis.range'])
+    return None, None
+
+
+def zoomed_out_as_none(func):
+    # the graph first fires {'autosize': True}: any relayout without an x range draws the same
+    # figure as None, the zoomed out view the export is rendered for
+    @wraps(func)
+    def wrapper(*args):
+        *rest, relayout_data = args
+        if zoom_range(relayout_data) == (None, None):
+            relayout_data = None
+        return func(*rest, relayout_data)
+
+    return wrapper
+
+
+# Create a Dash app
+app = dash.Dash(__name__)
+
+# callback timings on /metrics when started with DASH_PROFILE=1
+profile_app(app)
+
+# Define the layout
+app.layout = html.Div([
+    html.H1("Arrival Delay 2014 - 2018", style={'text-align': 'center'}),
+    html.Div([
+        html.Div([
+            html.Label("Destinations:"),
+            dcc.Dropdown(
+                id='scenario-dropdown',
+                options=[{'label': scenario, 'value': scenario} for scenario in SCENARIOS],
+                value='Testszenario 1',
+                clearable=False
+            ),
+        ], style={'width': '25%', 'display': 'inline-block'}),
+        html.Div([
+            html.Label("Downsampling:"),
+            dcc.RadioItems(
+                id='method-radio',
+                options=[{'label': 'min/max', 'value': 'minmax'},
+                         {'label': 'LTTB', 'value': 'lttb'}]
+                        + ([{'label': 'time pyramid', 'value': 'pyramid'}] if PYRAMID_AVAILABLE else [])
+                        + [{'label': 'none (all points)', 'value': 'none'}],
+                value='minmax',
+                inline=True
+            ),
+            html.Div("time pyramid unavailable: not built yet (python prep_pipeline.py run pyramids)",
+                     style={'font-size': 'small', 'color': 'gray'}) if not PYRAMID_AVAILABLE else None,
+        ], style={'width': '35%', 'display': 'inline-block'}),
+        html.Div([
+            html.Label("Chart:"),
+            dcc.RadioItems(
+                id='chart-radio',
+                options=[{'label': 'line', 'value': 'line'}, {'label': 'scatter', 'value': 'scatter'}],
+                value='line',
+                inline=True
+            ),
+            dcc.RadioItems(
+                id='render-radio',
+                options=[{'label': 'svg', 'value': 'svg'}, {'label': 'webgl', 'value': 'webgl'}],
+                value='webgl',
+                inline=True
+            ),
+        ], style={'width': '25%', 'display': 'inline-block'}),
+    ], style={'display': 'flex', 'justify-content': 'space-around', 'align-items': 'center', 'margin-bottom': '20px'}),
+    dcc.Graph(id='delay-graph', style={'width': f'{GRAPH_WIDTH}px', 'margin': 'auto'}),
+    html.Div(id='points-info', style={'text-align': 'center', 'margin-top': 10}),
+])
+
+
+def pyramid_figure(scenario, chart, render_mode, x0, x1):
+    # min-max band and mean of the delay per bucket, at the level that fits the visible range
+    n_dest = SCENARIOS[scenario]
+    airports = None if n_dest is None else flights_per_dest.head(n_dest).index
+    pyramid, pyramid_extent = load_pyramid()
+    level = choose_level(x0, x1, point_budget(GRAPH_WIDTH, 'minmax'), extent=pyramid_extent)
+    series = query(pyramid[level], x0, x1, airports)
+
+    scatter = go.Scattergl if render_mode == 'webgl' else go.Scatter
+    mode = 'lines' if chart == 'line' else 'markers'
+    fig = go.Figure([
+        scatter(x=series['bucket'], y=series['max'], mode='lines', line={'width': 0}, showlegend=False, hoverinfo='skip'),
+        scatter(x=series['bucket'], y=series['min'], mode='lines', line={'width': 0}, fill='tonexty',
+                fillcolor='rgba(99, 110, 250, 0.25)', name='min - max'),
+        scatter(x=series['bucket'], y=series['mean'], mode=mode, name='mean', customdata=series['count'],
+                hovertemplate='%{x}<br>mean %{y:.1f} min<br>%{customdata} flights<extra></extra>'),
+    ])
+    fig.update_layout(title=f'Arrival Delay ({scenario}, {level} buckets)', xaxis_title='ARR_DATETIME',
+                      yaxis_title='ARR_DELAY')
+    return fig, level, series
+
+
+# Re-aggregate the visible x range every time the user zooms or pans
+@app.callback(
+    [Output('delay-graph', 'figure'),
+     Output('points-info', 'children')],
+    [Input('scenario-dropdown', 'value'),
+     Input('method-radio', 'value'),
+     Input('chart-radio', 'value'),
+     Input('render-radio', 'value'),
+     Input('delay-graph', 'relayoutData')])
+@zoomed_out_as_none
+@static_figures.prerendered
+def update_delay_graph(scenario, method, chart, render_mode, relayout_data):
+    if method == 'pyramid' and not PYRAMID_AVAILABLE:
+        # a value restored from before the tables went missing
+        method = 'minmax'
+    if method == 'pyramid':
+        x0, x1 = zoom_range(relayout_data)
+        with phase('figure'):
+            fig, level, series = pyramid_figure(scenario, chart, render_mode, x0, x1)
+            fig.update_layout(uirevision=scenario, width=GRAPH_WIDTH)
+            if x0 is not None:
+                fig.update_xaxes(range=[x0, x1])
+        return fig, f"{len(series):,} {level} buckets of {int(series['count'].sum()):,} flights in view"
+
+    with phase('filter'):
+        x, y = scenario_series(scenario)
+        x0, x1 = zoom_range(relayout_data)
+        visible = visible_range(x, x0, x1)
+        x_visible, y_visible = x[visible], y[visible]
+
+    with phase('downsample'):
+        if method != 'none':
+            x_plot, y_plot = downsample(x_visible, y_visible, point_budget(GRAPH_WIDTH, method), method)
+        else:
+            x_plot, y_plot = x_visible, y_visible
+
+    with phase('figure'):
+        plot = px.line if chart == 'line' else px.scatter
+        fig = plot(x=x_plot, y=y_plot, render_mode=render_mode, labels={'x': 'ARR_DATETIME', 'y': 'ARR_DELAY'},
+                   title=f'Arrival Delay ({scenario} {render_mode})')
+        # keep the zoom when the figure is replaced, the data already covers exactly that range
+        fig.update_layout(uirevision=scenario, width=GRAPH_WIDTH)
+        if x0 is not None:
+            fig.update_xaxes(range=[x0, x1])
+
+    info = f"{len(x_plot):,} of {len(x_visible):,} points in view ({np.count_nonzero(y_visible > 15):,} delayed > 15 min)"
+    return fig, info
+
+
+# Run the app
+if __name__ == '__main__':
+    app.run_server(debug=True)
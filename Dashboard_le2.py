@@ -5,17 +5,41 @@ from dash import html
 import plotly.express as px
 import pandas as pd
 import numpy as np
+from dash_profiling import phase, profile_app
+from data_server import int_year, load_table
+from data_store import table_path
+from figure_cache import FigureCache, neighbors
+from gdp_index import GapminderIndex
+from static_export import StaticFigures
 
-# Load sample data
-df_gdp = pd.read_pickle('data_gapminder.pkl')
+# Load sample data (only the columns used, from the columnar store written by data_prep.ipynb),
+# with the year converted to int. DASH_SHARED_DATA=1 shares one copy between all workers
+df_gdp = load_table('data_gapminder', columns=['year', 'continent', 'country', 'gdpPercap', 'lifeExp', 'pop'], prepare=int_year)
 
-# turn year into a float
-df_gdp['year'] = df_gdp['year'].astype(int)
+# row positions per year / continent / country, all callbacks filter through this
+gdp_index = GapminderIndex(df_gdp)
+
+# the slider stops every 5 years from the first year
+slider_years = np.arange(gdp_index.years().min(), gdp_index.years().max() + 1, 5)
+
+# rendered figures by callback inputs; serving a year also renders the neighbouring stops in the background
+figure_cache = FigureCache(maxsize=256, watch=[table_path('data_gapminder')])
+
+# pre-rendered figures of static_export.py, served when started with STATIC_FIGURES_DIR=export
+static_figures = StaticFigures('Dashboard_le2')
+
+
+def adjacent_years(selected_year, *rest):
+    # the slider nearly always moves to a neighbouring stop, warm those figures in the background
+    return [(year, *rest) for year in neighbors(slider_years, selected_year)] if selected_year is not None else []
 
 
 # Create a Dash app
 app = dash.Dash(__name__)
 
+# callback timings on /metrics when started with DASH_PROFILE=1
+profile_app(app)
+
 # Define the layout
 app.layout = html.Div([
     html.H1('Gapminder Visualization'),
@@ -30,17 +54,17 @@ app.layout = html.Div([
     html.Div([
         dcc.Slider(
             id='year-slider',
-            min=df_gdp['year'].min(),
-            max=df_gdp['year'].max(),
-            value=df_gdp['year'].min(),
-            marks={str(year): str(year) for year in range(df_gdp['year'].min(), df_gdp['year'].max() + 1, 5)},
+            min=gdp_index.years().min(),
+            max=gdp_index.years().max(),
+            value=gdp_index.years().min(),
+            marks={str(year): str(year) for year in range(gdp_index.years().min(), gdp_index.years().max() + 1, 5)},
             step=5
         ),
         html.Label("Select a continent:"),
         dcc.Dropdown(
             id='continent-dropdown',
-            options=[{"label": i, "value": i} for i in df_gdp["continent"].unique()],
-            value=df_gdp['continent'].unique()[0],
+            options=[{"label": i, "value": i} for i in gdp_index.continents()],
+            value=gdp_index.continents()[0],
             multi=True
         ),
     ], style={'margin': '20px 0px 50px 0px'}),
@@ -52,14 +76,18 @@ app.layout = html.Div([
     dash.dependencies.Output('graph', 'figure'),
     [dash.dependencies.Input('year-slider', 'value'),
     dash.dependencies.Input('continent-dropdown', 'value')])
+@static_figures.prerendered
+@figure_cache.cached(prefetch=adjacent_years)
 def update_figure(selected_year, selected_continent):
     if type(selected_continent) == str:
         selected_continent = [selected_continent]
-    filtered_df = df_gdp[(df_gdp['year'] == selected_year) & (df_gdp['continent'].isin(selected_continent))]
-    # group by country
-    filtered_df = filtered_df.groupby(['country', 'continent']).mean().reset_index()
-    fig = px.scatter(filtered_df, x="gdpPercap", y="lifeExp", size="pop", color="continent", hover_name="country", size_max=60)
-    fig.update_layout(transition_duration=500)
+    with phase('filter'):
+        filtered_df = gdp_index.select(selected_year, selected_continent)
+        # group by country
+        filtered_df = filtered_df.groupby(['country', 'continent']).mean().reset_index()
+    with phase('figure'):
+        fig = px.scatter(filtered_df, x="gdpPercap", y="lifeExp", size="pop", color="continent", hover_name="country", size_max=60)
+        fig.update_layout(transition_duration=500)
     return fig
 
 # Callback for updating the bar chart
@@ -67,17 +95,21 @@ def update_figure(selected_year, selected_continent):
     dash.dependencies.Output('bar-chart', 'figure'),
     [dash.dependencies.Input('year-slider', 'value'),
     dash.dependencies.Input('continent-dropdown', 'value')])
+@static_figures.prerendered
+@figure_cache.cached(prefetch=adjacent_years)
 def update_bar_chart(selected_year, selected_continent):
     if type(selected_continent) == str:
         selected_continent = [selected_continent]
     # Filter the DataFrame for the selected year
-    filtered_df = df_gdp[(df_gdp['year'] == selected_year) & (df_gdp['continent'].isin(selected_continent))]
+    with phase('filter'):
+        filtered_df = gdp_index.select(selected_year, selected_continent)
     
     # Create a bar chart
-    fig = px.bar(filtered_df, x='country', y='pop', title='Population by Country')
+    with phase('figure'):
+        fig = px.bar(filtered_df, x='country', y='pop', title='Population by Country')
 
-    # Optionally, you can customize the layout of the figure here
-    fig.update_layout(transition_duration=500)
+        # Optionally, you can customize the layout of the figure here
+        fig.update_layout(transition_duration=500)
 
     return fig
 
@@ -1,4 +1,5 @@
 # Import necessary libraries
+import os
 import dash
 from dash import dcc
 from dash import html
@@ -6,28 +7,53 @@ import plotly.express as px
 import pandas as pd
 import numpy as np
 from dash import callback_context
+from dash import ClientsideFunction
+from dash_profiling import phase, profile_app
+from data_server import int_year, load_table
+from data_store import table_path
+from figure_cache import FigureCache
+from gdp_clientside import clientside_enabled, encode_columns, register_payload, skip_callback
+from gdp_index import GapminderIndex
+from static_export import StaticFigures
 
-# Load sample data
-df_gdp = pd.read_pickle('data_gapminder.pkl')
+# Load sample data (only the columns used, from the columnar store written by data_prep.ipynb),
+# with the year converted to int. DASH_SHARED_DATA=1 shares one copy between all workers
+df_gdp = load_table('data_gapminder', columns=['year', 'continent', 'country', 'gdpPercap', 'lifeExp', 'pop'], prepare=int_year)
 
-# convert year to int
-df_gdp.year = df_gdp.year.astype(int)
+# row positions per year / continent / country, all callbacks filter through this
+gdp_index = GapminderIndex(df_gdp)
+
+# rendered figures by callback inputs, rebuilt when the data in the store changes
+# (set FIGURE_CACHE_DIR to share them between Gunicorn workers)
+figure_cache = FigureCache(maxsize=256, watch=[table_path('data_gapminder')])
+
+# pre-rendered figures of static_export.py, served when started with STATIC_FIGURES_DIR=export
+static_figures = StaticFigures('Dashboard_le3')
 
 # Create a Dash app
 app = dash.Dash(__name__)
 
+# callback timings on /metrics when started with DASH_PROFILE=1
+profile_app(app)
+
+# With DASH_CLIENTSIDE=1 df_gdp is sent to the browser once per session (gdp-data store) and
+# filters / figures run in assets/gapminder_clientside.js, the server callbacks below stay unregistered
+CLIENTSIDE = clientside_enabled()
+server_callback = skip_callback if CLIENTSIDE else app.callback
+
 # Define the layout
 app.layout = html.Div([
+    dcc.Store(id='gdp-data', storage_type='session'),
     html.H1("Gapminder Dataset", style={'text-align': 'center'}),
     html.Div([
         html.Div([
             html.Label("Select a year:"),
             dcc.Slider(
                 id='year-slider',
-                min=df_gdp['year'].min(),
-                max=df_gdp['year'].max(),
-                value=df_gdp['year'].min(),
-                marks={str(year): str(year) for year in range(df_gdp['year'].min(), df_gdp['year'].max() + 1, 5)},
+                min=gdp_index.years().min(),
+                max=gdp_index.years().max(),
+                value=gdp_index.years().min(),
+                marks={str(year): str(year) for year in range(gdp_index.years().min(), gdp_index.years().max() + 1, 5)},
                 step=5
             ),
         ], style={'width': '48%', 'display': 'inline-block'}),
@@ -35,8 +61,8 @@ app.layout = html.Div([
             html.Label("Select a continent:"),
             dcc.Dropdown(
                 id='continent-dropdown',
-                options=[{'label': continent, 'value': continent} for continent in df_gdp['continent']. unique()],
-                value=df_gdp['continent'].unique()[0]
+                options=[{'label': continent, 'value': continent} for continent in gdp_index.continents()],
+                value=gdp_index.continents()[0]
             ),
         ], style={'width': '48%', 'display': 'inline-block'}),
     ], style={'padding': '20px', 'display': 'flex', 'justify-content': 'space-between'}),
@@ -52,7 +78,7 @@ app.layout = html.Div([
 ])
 
 # Define the callback for the output-container
-@app.callback(
+@server_callback(
     dash.dependencies.Output('output-container', 'children'),  # Corrected the id here
     [dash.dependencies.Input('year-slider', 'value'),
      dash.dependencies.Input('continent-dropdown', 'value')])
@@ -61,28 +87,48 @@ def update_output(selected_year, selected_continent):
 
 
 # Define the callbacks for the scatterplot and bar chart
-@app.callback(
+@server_callback(
     [dash.dependencies.Output('graph', 'figure'), 
      dash.dependencies.Output('bar-chart', 'figure')],
     [dash.dependencies.Input('year-slider', 'value'),
      dash.dependencies.Input('continent-dropdown', 'value')])
+@static_figures.prerendered
+@figure_cache.cached
 def update_charts(selected_year, selected_continent):
     if type(selected_continent) == str:
         selected_continent = [selected_continent]
 
     # Filter the DataFrame for the selected year and continent
-    filtered_df = df_gdp[(df_gdp['year'] == selected_year) & (df_gdp['continent'].isin(selected_continent))]
+    with phase('filter'):
+        filtered_df = gdp_index.select(selected_year, selected_continent)
     
-    # Scatter plot
-    scatter_fig = px.scatter(filtered_df, x='gdpPercap', y='lifeExp', size='pop', hover_name='country')
-    scatter_fig.update_layout(transition_duration=500, hovermode='closest', hoverdistance=100)
+    with phase('figure'):
+        # Scatter plot
+        scatter_fig = px.scatter(filtered_df, x='gdpPercap', y='lifeExp', size='pop', hover_name='country')
+        scatter_fig.update_layout(transition_duration=500, hovermode='closest', hoverdistance=100)
 
-    # Bar chart
-    bar_fig = px.bar(filtered_df, x='country', y='pop', title='Population by Country')
-    bar_fig.update_layout(transition_duration=500)
+        # Bar chart
+        bar_fig = px.bar(filtered_df, x='country', y='pop', title='Population by Country')
+        bar_fig.update_layout(transition_duration=500)
 
     return scatter_fig, bar_fig
 
+if CLIENTSIDE:
+    register_payload(app, 'gdp-data', encode_columns(df_gdp, df_gdp.columns, version=os.path.getmtime(table_path('data_gapminder'))))
+
+    app.clientside_callback(
+        ClientsideFunction('gapminder', 'le3Output'),
+        dash.dependencies.Output('output-container', 'children'),
+        [dash.dependencies.Input('year-slider', 'value'),
+         dash.dependencies.Input('continent-dropdown', 'value')])
+    app.clientside_callback(
+        ClientsideFunction('gapminder', 'le3Charts'),
+        [dash.dependencies.Output('graph', 'figure'),
+         dash.dependencies.Output('bar-chart', 'figure')],
+        [dash.dependencies.Input('year-slider', 'value'),
+         dash.dependencies.Input('continent-dropdown', 'value'),
+         dash.dependencies.Input('gdp-data', 'data')])
+
 # Run the app
 if __name__ == '__main__':
     app.run_server(debug=True)
\ No newline at end of file
@@ -0,0 +1,58 @@
+# Airport dimension table, joined to the flights by an integer key instead of a full merge
+#
+# The airports (flight_ingest.read_airports) are stored once as store/airports/, sorted by
+# code, and the row position is the key. The flight tables keep ORIGIN / DEST plus a small
+# ORIGIN_KEY / DEST_KEY column instead of every airport attribute on every row; a view that
+# needs attributes looks up only those columns with a vectorized take:
+#
+#   airports = read_dimension()
+#   attributes = lookup(airports, flight_data_arr['DEST_KEY'], ['state', 'city'], suffix='_dest')
+#
+# The keys are positions in the dimension written together with the flights, so both are
+# exported by the same data_prep.ipynb run.
+import numpy as np
+import pandas as pd
+
+from data_store import STORE_ROOT, read_table, write_table
+
+DIMENSION = 'airports'
+
+
+def build_dimension(airports):
+    """One row per airport code, sorted by code, the row position is the airport key."""
+    return airports.drop_duplicates('code').sort_values('code', ignore_index=True)
+
+
+def write_dimension(airports, root=STORE_ROOT):
+    write_table(airports, DIMENSION, root=root)
+
+
+def read_dimension(columns=None, root=STORE_ROOT):
+    return read_table(DIMENSION, columns=columns, root=root, mmap=False)
+
+
+def airport_keys(codes, airports):
+    """Key of every airport code (-1 for codes not in the dimension), in the smallest int type."""
+    keys = pd.Index(airports['code']).get_indexer(np.asarray(codes))
+    return pd.to_numeric(pd.Series(keys, index=getattr(codes, 'index', None)), downcast='integer')
+
+
+def add_keys(flights, column, airports, key_column=None):
+    """flights with a `<column>_KEY` column, rows without a known airport are dropped (like the inner merge)."""
+    keys = airport_keys(flights[column], airports)
+    known = (keys >= 0).to_numpy()
+    flights = flights[known].copy() if not known.all() else flights.copy()
+    flights[key_column or f'{column}_KEY'] = keys[known].to_numpy()
+    return flights
+
+
+def lookup(airports, keys, columns=None, suffix=''):
+    """Airport attributes for every key, aligned with `keys`; unknown keys (-1) get missing values."""
+    attributes = airports if columns is None else airports[columns]
+    keys = pd.Series(keys)
+    known = (keys >= 0).to_numpy()
+    values = attributes.take(np.where(known, keys.to_numpy(), 0))
+    values.index = keys.index
+    if not known.all():
+        values = values.where(pd.Series(known, index=keys.index), axis=0)
+    return values.rename(columns={column: column + suffix for column in values.columns})
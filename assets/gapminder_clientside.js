@@ -0,0 +1,214 @@
+// Clientside callbacks of the gapminder dashboards (DASH_CLIENTSIDE=1, see gdp_clientside.py)
+//
+// `data` is the payload of gdp_clientside.encode_columns, kept in a session dcc.Store:
+//   {rows: n, columns: {year: [...], country: {codes: [...], categories: [...]}, ...}, template: {...}}
+// The filters follow GapminderIndex (rows in data order), the figures follow the px calls of
+// the server side callbacks.
+
+// px.colors.qualitative.Plotly and px.colors.sequential.Plasma
+var QUALITATIVE = ['#636efa', '#EF553B', '#00cc96', '#ab63fa', '#FFA15A', '#19d3f3', '#FF6692', '#B6E880', '#FF97FF', '#FECB52'];
+var PLASMA = ['#0d0887', '#46039f', '#7201a8', '#9c179e', '#bd3786', '#d8576b', '#ed7953', '#fb9f3a', '#fdca26', '#f0f921'];
+
+// decoded columns per payload, the store hands the same object to every callback
+var decoded = new WeakMap();
+
+function columns(data) {
+    var cached = decoded.get(data);
+    if (cached) {
+        return cached;
+    }
+    cached = {};
+    Object.keys(data.columns).forEach(function (name) {
+        var column = data.columns[name];
+        cached[name] = Array.isArray(column) ? column : column.codes.map(function (code) {
+            return code < 0 ? null : column.categories[code];
+        });
+    });
+    decoded.set(data, cached);
+    return cached;
+}
+
+function positions(data, year, continent, country) {
+    // row positions of a year, optionally restricted to one or more continents and a country;
+    // like GapminderIndex: continent left out = every continent, null (cleared dropdown) = none
+    var cols = columns(data);
+    var continents = continent === undefined ? null : (continent === null ? [] : [].concat(continent));
+    var rows = [];
+    for (var i = 0; i < data.rows; i++) {
+        if (cols.year[i] !== year) continue;
+        if (continents !== null && continents.indexOf(cols.continent[i]) < 0) continue;
+        if (country != null && cols.country[i] !== country) continue;
+        rows.push(i);
+    }
+    return rows;
+}
+
+function take(values, rows) {
+    return rows.map(function (i) { return values[i]; });
+}
+
+function baseLayout(data, layout) {
+    return Object.assign({template: data.template, legend: {tracegroupgap: 0}, margin: {t: 60}}, layout);
+}
+
+function axes(x, y) {
+    return {xaxis: {anchor: 'y', domain: [0, 1], title: {text: x}},
+            yaxis: {anchor: 'x', domain: [0, 1], title: {text: y}}};
+}
+
+function sizeref(values) {
+    // px: sizemode 'area', sizeref = max / size_max ** 2 with size_max 20
+    var max = Math.max.apply(null, values.filter(function (v) { return v != null; }).concat([0]));
+    return max > 0 ? max / (20 * 20) : 1;
+}
+
+function scatterFigure(data, rows, x, y, size, color) {
+    // px.scatter(df, x=x, y=y, size=size, hover_name='country', color=color)
+    var cols = columns(data);
+    var ref = sizeref(take(cols[size], rows));
+    var groups = [];
+    var byGroup = {};
+    rows.forEach(function (i) {
+        var key = color ? cols[color][i] : '';
+        if (!(key in byGroup)) {
+            byGroup[key] = [];
+            groups.push(key);
+        }
+        byGroup[key].push(i);
+    });
+    var hover = '<b>%{hovertext}</b><br><br>' + (color ? color + '=' : '');
+    var traces = groups.map(function (key, n) {
+        var group = byGroup[key];
+        return {
+            type: 'scatter', mode: 'markers', name: key, legendgroup: key, showlegend: Boolean(color),
+            x: take(cols[x], group), y: take(cols[y], group), hovertext: take(cols.country, group),
+            marker: {color: QUALITATIVE[n % QUALITATIVE.length], size: take(cols[size], group),
+                     sizemode: 'area', sizeref: ref, symbol: 'circle'},
+            hovertemplate: hover + (color ? key + '<br>' : '') + x + '=%{x}<br>' + y + '=%{y}<br>' + size +
+                           '=%{marker.size}<extra></extra>',
+            xaxis: 'x', yaxis: 'y', orientation: 'v'
+        };
+    });
+    var layout = baseLayout(data, Object.assign(axes(x, y), {transition: {duration: 500}}));
+    if (color) {
+        layout.legend = {tracegroupgap: 0, itemsizing: 'constant', title: {text: color}};
+    }
+    return {data: traces, layout: layout};
+}
+
+function barFigure(data, rows, x, y, title) {
+    // px.bar(df, x=x, y=y, title=title)
+    var cols = columns(data);
+    var layout = baseLayout(data, Object.assign(axes(x, y), {barmode: 'relative', transition: {duration: 500}}));
+    if (title) {
+        layout.title = {text: title};
+    }
+    return {
+        data: [{type: 'bar', x: take(cols[x], rows), y: take(cols[y], rows), name: '', showlegend: false,
+                marker: {color: QUALITATIVE[0]}, orientation: 'v', textposition: 'auto',
+                hovertemplate: x + '=%{x}<br>' + y + '=%{y}<extra></extra>'}],
+        layout: layout
+    };
+}
+
+function mapFigure(data, rows, selectedCountry) {
+    // px.choropleth of Dashboard_LE4_fast.update_map
+    var cols = columns(data);
+    var trace = {
+        type: 'choropleth', geo: 'geo', coloraxis: 'coloraxis', name: '',
+        locations: take(cols['alpha-3'], rows), z: take(cols.gdpPercapita, rows), hovertext: take(cols.country, rows),
+        customdata: rows.map(function (i) { return [cols.country[i], cols.population[i], cols.lifeExpectancy[i]]; }),
+        hovertemplate: '<b>%{hovertext}</b><br><br>country=%{customdata[0]}<br>gdpPercapita=%{z:.2f}<br>' +
+                       'population=%{customdata[1]}<br>lifeExpectancy=%{customdata[2]:.1f}<extra></extra>'
+    };
+    var layout = baseLayout(data, {
+        geo: {domain: {x: [0, 1], y: [0, 1]}, center: {}},
+        coloraxis: {
+            colorscale: PLASMA.map(function (color, n) { return [n / (PLASMA.length - 1), color]; }),
+            colorbar: {thickness: 10, len: 0.3, title: {text: 'GDP per Capita', side: 'right'}}
+        },
+        transition: {duration: 500},
+        width: 1000,
+        height: 1000,
+        margin: {l: 0, r: 0, t: 0, b: 0, autoexpand: true}
+    });
+    if (selectedCountry) {
+        var selected = rows.filter(function (i) { return cols.country[i] === selectedCountry; });
+        trace.marker = {line: {width: 3, color: 'gold'}};
+        if (selected.length) {
+            var code = cols['alpha-3'][selected[0]];
+            layout.annotations = [{x: code, y: code, showarrow: true, arrowhead: 1,
+                                   text: selectedCountry + ': ' + Number(cols.gdpPercapita[selected[0]]).toFixed(2)}];
+        }
+    }
+    return {data: [trace], layout: layout};
+}
+
+function countryOptions(data, continent) {
+    // GapminderIndex.countries(continent), in data order
+    var cols = columns(data);
+    var seen = {};
+    var options = [];
+    for (var i = 0; i < data.rows; i++) {
+        var country = cols.country[i];
+        if (cols.continent[i] === continent && !(country in seen)) {
+            seen[country] = true;
+            options.push({label: country, value: country});
+        }
+    }
+    return options;
+}
+
+function noUpdate() {
+    // no data yet (first page load of the session), the store callback fills it
+    return window.dash_clientside.no_update;
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    gapminder: {
+        // Dashboard_LE4_fast.py
+        le4Store: function (selectedYear, stored) {
+            return Object.assign({}, stored, {selected_year: selectedYear});
+        },
+        le4Countries: function (selectedContinent, data) {
+            if (!data) return noUpdate();
+            return selectedContinent != null ? countryOptions(data, selectedContinent) : [];
+        },
+        le4Scatter: function (selectedYear, selectedContinent, selectedCountry, data) {
+            if (!data) return noUpdate();
+            var rows = positions(data, selectedYear, selectedContinent, selectedCountry);
+            return scatterFigure(data, rows, 'gdpPercapita', 'lifeExpectancy', 'population', 'country');
+        },
+        le4Bar: function (selectedYear, selectedContinent, selectedCountry, data) {
+            if (!data) return noUpdate();
+            var rows = positions(data, selectedYear, selectedContinent, selectedCountry);
+            return barFigure(data, rows, 'country', 'population');
+        },
+        le4Map: function (pathname, selectedCountry, selectedYear, data) {
+            if (pathname !== '/map') return {};
+            if (!data) return noUpdate();
+            if (selectedYear == null) {
+                selectedYear = Math.max.apply(null, columns(data).year);
+            }
+            var rows = positions(data, selectedYear);
+            if (selectedCountry != null) {
+                var countryRows = positions(data, selectedYear, undefined, selectedCountry);
+                if (countryRows.length) rows = countryRows;
+            }
+            return mapFigure(data, rows, selectedCountry);
+        },
+
+        // Dashboard_le3.py
+        le3Output: function (selectedYear, selectedContinent) {
+            return 'Selected Year: ' + Math.trunc(selectedYear) + ', Selected Continent: ' + selectedContinent;
+        },
+        le3Charts: function (selectedYear, selectedContinent, data) {
+            if (!data) return [noUpdate(), noUpdate()];
+            var rows = positions(data, selectedYear, selectedContinent);
+            var scatter = scatterFigure(data, rows, 'gdpPercap', 'lifeExp', 'pop', null);
+            scatter.layout.hovermode = 'closest';
+            scatter.layout.hoverdistance = 100;
+            return [scatter, barFigure(data, rows, 'country', 'pop', 'Population by Country')];
+        }
+    }
+});
@@ -0,0 +1,84 @@
+# Benchmark: string based datetime cells of data_prep.ipynb vs. flight_prep.build_datetimes
+#
+# python bench_datetime.py                     -> synthetic data (1,000,000 rows)
+# python bench_datetime.py --rows 5000000
+# python bench_datetime.py --csv Data/2018.csv -> real BTS data
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from flight_prep import DATETIME_COLUMNS, build_datetimes
+
+TIME_COLUMNS = list(DATETIME_COLUMNS.values())
+
+
+def notebook_datetimes(flight_data):
+    # same steps as the cells in data_prep.ipynb before the vectorized version
+    flight_data = flight_data.copy()
+    for col in TIME_COLUMNS:
+        flight_data[col] = flight_data[col].astype(int) / 100
+        flight_data[col] = flight_data[col].astype(str)
+        flight_data[col] = flight_data[col].str.replace('.', ':')
+        flight_data[col] = flight_data[col].apply(lambda x: x if len(x.split(':')[1]) == 2 else x + '0')
+        flight_data[col] = flight_data[col].apply(lambda x: '0' + x if len(x) < 5 else x)
+        flight_data[col] = flight_data[col].apply(lambda x: '00:00' if x == '24:00' else x)
+    for datetime_col, col in DATETIME_COLUMNS.items():
+        flight_data[datetime_col] = pd.to_datetime(flight_data['FL_DATE'] + ' ' + flight_data[col].astype(str), format='%Y-%m-%d %H:%M')
+    return flight_data
+
+
+def synthetic_flights(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2018-01-01', '2018-12-31').strftime('%Y-%m-%d').values
+    data = {'FL_DATE': dates[rng.integers(0, len(dates), rows)]}
+    for col in TIME_COLUMNS:
+        hhmm = rng.integers(0, 24, rows) * 100 + rng.integers(0, 60, rows)
+        hhmm[rng.random(rows) < 0.001] = 2400
+        data[col] = hhmm.astype(float)
+    return pd.DataFrame(data)
+
+
+def load_flights(path):
+    flight_data = pd.read_csv(path, usecols=['FL_DATE'] + TIME_COLUMNS)
+    return flight_data.dropna(subset=TIME_COLUMNS)
+
+
+def timed(func, flight_data, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(flight_data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the datetime build of data_prep.ipynb')
+    parser.add_argument('--csv', help='BTS csv to benchmark on instead of synthetic data')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    flight_data = load_flights(args.csv) if args.csv else synthetic_flights(args.rows)
+    print(f"{len(flight_data):,} rows x {len(TIME_COLUMNS)} time columns")
+
+    t_old, old = timed(notebook_datetimes, flight_data, args.repeat)
+    t_new, new = timed(build_datetimes, flight_data, args.repeat)
+    print(f"notebook cells:  {t_old:8.3f} s")
+    print(f"build_datetimes: {t_new:8.3f} s  ({t_old / t_new:.1f}x faster)")
+
+    # the only intended difference: 2400 now rolls over to 00:00 of the next day
+    for datetime_col, col in DATETIME_COLUMNS.items():
+        rollover = (flight_data[col] == 2400).values
+        same = (old[datetime_col].values == new[datetime_col].values)
+        shifted = (new[datetime_col].values - old[datetime_col].values) == np.timedelta64(1, 'D')
+        assert same[~rollover].all(), datetime_col
+        assert shifted[rollover].all(), datetime_col
+        print(f"{datetime_col}: identical except {rollover.sum():,} rows at 2400 moved to the next day")
+
+
+if __name__ == '__main__':
+    main()
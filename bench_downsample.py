@@ -0,0 +1,54 @@
+# Benchmark: LE1_performance.ipynb test scenarios with and without downsampling
+#
+# For every scenario (smallest 200 / 250 / 300 destinations), chart (line / scatter) and
+# render mode (svg / webgl) the figure is built from all points and from the downsampled
+# series, reporting points, figure build time, JSON serialization time and HTML size
+# (without plotly.js, which is the same for every file).
+#
+# python bench_downsample.py                   -> flight_data_arr from the store
+# python bench_downsample.py --synthetic 500000
+import argparse
+import time
+
+import pandas as pd
+
+from downsample import downsample, point_budget
+from render_bench import load_arrivals, render_once, scenario_series
+
+SCENARIOS = {1: 200, 2: 250, 3: 300}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the LE1 test scenarios with and without downsampling')
+    parser.add_argument('--synthetic', type=int, help='use n synthetic flights instead of the store')
+    parser.add_argument('--width', type=int, default=1200, help='plot width in pixels, sets the point budget')
+    parser.add_argument('--csv', help='also write the results to this csv file')
+    args = parser.parse_args()
+
+    flight_data_arr = load_arrivals(args.synthetic)
+    rows = []
+    for scenario, n_dest in SCENARIOS.items():
+        x, y = scenario_series(flight_data_arr, n_dest)
+        for method in ('none', 'lttb', 'minmax'):
+            start = time.perf_counter()
+            if method == 'none':
+                x_plot, y_plot = x, y
+            else:
+                x_plot, y_plot = downsample(x, y, point_budget(args.width, method), method)
+            reduce = time.perf_counter() - start
+            for chart in ('line', 'scatter'):
+                for render_mode in ('svg', 'webgl'):
+                    build, serialize, html_bytes = render_once(x_plot, y_plot, chart, render_mode)
+                    rows.append({'scenario': scenario, 'method': method, 'chart': chart, 'render_mode': render_mode,
+                                 'points': len(x_plot), 'downsample_s': reduce, 'build_s': build,
+                                 'serialize_s': serialize, 'html_bytes': html_bytes})
+
+    results = pd.DataFrame(rows)
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(results.to_string(index=False, float_format=lambda v: f'{v:.4f}'))
+    if args.csv:
+        results.to_csv(args.csv, index=False)
+
+
+if __name__ == '__main__':
+    main()
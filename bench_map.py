@@ -0,0 +1,85 @@
+# Benchmark: bytes sent per map interaction, full px.choropleth vs base figure + Patch
+#
+# For every slider year the map callback of Dashboard_LE4_fast.py is called in both modes
+# and the response is measured as JSON (raw and gzip, as sent with compression enabled).
+# The patch mode also sends the base figure once, with the map page.
+#
+# python bench_map.py                          -> data_gapminder_join from the store
+# python bench_map.py --country Japan
+# python bench_map.py --geojson countries.geojson --tolerances 0 0.01 0.05 0.1 --decimals 2
+import argparse
+import gzip
+import json
+import os
+
+import pandas as pd
+import plotly
+
+os.environ['DASH_MAP_MODE'] = 'patch'
+
+import Dashboard_LE4_fast as dashboard  # noqa: E402
+from map_patch import ChoroplethMap, payload_bytes  # noqa: E402
+
+
+def gzip_bytes(value):
+    if not isinstance(value, (dict, list)):
+        value = value.to_plotly_json()
+    return len(gzip.compress(json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder).encode()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the bytes per map interaction of the full and patch map modes')
+    parser.add_argument('--country', help='selected country (default: none)')
+    parser.add_argument('--geojson', help='also measure the base figure with this GeoJSON geometry')
+    parser.add_argument('--tolerances', nargs='+', type=float, default=[0, 0.01, 0.05, 0.1, 0.25],
+                        help='Douglas-Peucker tolerances (degrees) of the GeoJSON to measure, 0 only rounds')
+    parser.add_argument('--decimals', type=int, default=2, help='coordinates of the GeoJSON rounded to this many decimals')
+    parser.add_argument('--csv', help='also write the results to this csv file')
+    args = parser.parse_args()
+
+    rows = []
+    for year in dashboard.gdp_index.years():
+        full = dashboard.map_figure('/map', args.country, year, {})
+        patch = dashboard.update_map('/map', args.country, year, {})
+        rows.append({'year': int(year), 'full_bytes': payload_bytes(full), 'full_gzip': gzip_bytes(full),
+                     'patch_bytes': payload_bytes(patch), 'patch_gzip': gzip_bytes(patch)})
+    results = pd.DataFrame(rows)
+    results['saved_pct'] = (100 * (1 - results['patch_bytes'] / results['full_bytes'])).round(1)
+
+    world_map = dashboard.world_map
+    latest = dashboard.gdp_index.select(dashboard.gdp_index.years().max())
+
+    def base_figure(geometry, tolerance=0):
+        # the base of the map page (latest year) with another geometry
+        return ChoroplethMap(dashboard.df_gdp, world_map.location, world_map.color, world_map.hover_name, world_map.hover_data,
+                             geometry=geometry, tolerance=tolerance, decimals=args.decimals).base(latest, **dashboard.MAP_LAYOUT)
+
+    def points(fig):
+        # coordinates in the figure's GeoJSON, None for the builtin maps / the raw file
+        geojson = None if isinstance(fig, dict) else fig.to_plotly_json()['data'][0].get('geojson')
+        if geojson is None:
+            return None
+        return sum(len(ring) for feature in geojson['features'] for polygon in feature['geometry']['coordinates'] for ring in polygon)
+
+    base = {'110m': dashboard.map_base, '50m': base_figure('50m')}
+    if args.geojson:
+        with open(args.geojson) as f:
+            base['geojson file'] = json.load(f)
+        for tolerance in args.tolerances:
+            base[f'geojson (tolerance {tolerance}, {args.decimals} decimals)'] = base_figure(args.geojson, tolerance)
+    base = pd.DataFrame([{'geometry': name, 'points': points(fig), 'bytes': payload_bytes(fig), 'gzip': gzip_bytes(fig)}
+                         for name, fig in base.items()])
+
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(results.to_string(index=False))
+        print()
+        print('per interaction (mean):', results[['full_bytes', 'full_gzip', 'patch_bytes', 'patch_gzip']].mean().round().to_dict())
+        print()
+        print('base figure, sent once with the map page (the builtin topojson is loaded by plotly.js):')
+        print(base.to_string(index=False))
+    if args.csv:
+        results.to_csv(args.csv, index=False)
+
+
+if __name__ == '__main__':
+    main()
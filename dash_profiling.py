@@ -0,0 +1,146 @@
+# Opt-in callback profiling for the Dash apps
+#
+#   app = dash.Dash(__name__)
+#   profile_app(app)              # does nothing unless DASH_PROFILE=1 is set
+#
+#   def update_scatter(...):
+#       with phase('filter'):
+#           filtered_df = ...
+#       with phase('figure'):
+#           fig = px.scatter(...)
+#
+# Every request to _dash-update-component is timed (wall time, serialized response bytes,
+# trigger source, the phases above) per callback output. The numbers are served on
+# /metrics (Prometheus text format) and /metrics.json and logged every DASH_PROFILE_INTERVAL
+# seconds (default 60), so the "fast" and "slow" LE4 dashboards can be compared directly:
+#
+#   DASH_PROFILE=1 python Dashboard_LE4_fast.py
+#   curl localhost:8050/metrics
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+
+import flask
+import numpy as np
+
+logger = logging.getLogger('dash_profiling')
+
+PHASES = ('filter', 'figure')
+
+
+@contextmanager
+def phase(name):
+    """Time a part of a callback (e.g. 'filter', 'figure'), no-op when profiling is off."""
+    record = flask.g.get('dash_profile') if flask.has_request_context() else None
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record['phases'][name] += time.perf_counter() - start
+
+
+class CallbackProfiler:
+    def __init__(self, app, window=1000, log_interval=60):
+        self.app = app
+        self.window = window
+        self.log_interval = log_interval
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._triggers = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+        server = app.server
+        server.before_request(self._before)
+        server.after_request(self._after)
+        server.add_url_rule('/metrics', 'dash_profiling_metrics', self.metrics_text)
+        server.add_url_rule('/metrics.json', 'dash_profiling_metrics_json', self.metrics_json)
+        if log_interval:
+            threading.Thread(target=self._log_loop, name='dash-profiling-log', daemon=True).start()
+
+    def _before(self):
+        if flask.request.path.endswith('_dash-update-component'):
+            flask.g.dash_profile = {'start': time.perf_counter(), 'phases': defaultdict(float)}
+
+    def _after(self, response):
+        record = flask.g.pop('dash_profile', None)
+        if record is None:
+            return response
+        wall = time.perf_counter() - record['start']
+        body = flask.request.get_json(silent=True) or {}
+        output = body.get('output', '?')
+        # changedPropIds is what callback_context.triggered is built from
+        trigger = ','.join(body.get('changedPropIds', [])) or 'initial'
+        sample = {
+            'wall': wall,
+            'bytes': response.calculate_content_length() or 0,
+            'prevented': response.status_code == 204,
+            **{name: record['phases'].get(name, 0.0) for name in set(PHASES) | set(record['phases'])},
+        }
+        with self._lock:
+            self._samples[output].append(sample)
+            self._triggers[output][trigger] += 1
+        return response
+
+    def summary(self):
+        """Per callback output: calls, wall time percentiles, mean phase times, response bytes, triggers."""
+        with self._lock:
+            samples = {output: list(values) for output, values in self._samples.items()}
+            triggers = {output: dict(counter) for output, counter in self._triggers.items()}
+
+        summary = {}
+        for output, values in samples.items():
+            wall = np.array([s['wall'] for s in values]) * 1000
+            sizes = np.array([s['bytes'] for s in values])
+            phases = sorted({key for s in values for key in s} - {'wall', 'bytes', 'prevented'})
+            summary[output] = {
+                'calls': len(values),
+                'prevented': sum(s['prevented'] for s in values),
+                'wall_ms_p50': float(np.percentile(wall, 50)),
+                'wall_ms_p95': float(np.percentile(wall, 95)),
+                'wall_ms_max': float(wall.max()),
+                **{f'{name}_ms_mean': float(np.mean([s.get(name, 0.0) for s in values]) * 1000) for name in phases},
+                'bytes_mean': float(sizes.mean()),
+                'bytes_max': int(sizes.max()),
+                'triggers': triggers.get(output, {}),
+            }
+        return summary
+
+    def metrics_json(self):
+        return flask.Response(json.dumps(self.summary(), indent=1), mimetype='application/json')
+
+    def metrics_text(self):
+        lines = []
+        for output, stats in self.summary().items():
+            label = output.replace('\\', '\\\\').replace('"', '\\"')
+            for key, value in stats.items():
+                if key == 'triggers':
+                    for trigger, count in value.items():
+                        lines.append(f'dash_callback_trigger_total{{output="{label}",trigger="{trigger}"}} {count}')
+                else:
+                    lines.append(f'dash_callback_{key}{{output="{label}"}} {value}')
+        return flask.Response('\n'.join(lines) + '\n', mimetype='text/plain')
+
+    def log_summary(self):
+        for output, stats in sorted(self.summary().items()):
+            phases = ' '.join(f"{key[:-8]}={value:.1f}ms" for key, value in stats.items() if key.endswith('_ms_mean'))
+            logger.info("%s calls=%d p50=%.1fms p95=%.1fms %s bytes=%.0f",
+                        output, stats['calls'], stats['wall_ms_p50'], stats['wall_ms_p95'], phases, stats['bytes_mean'])
+
+    def _log_loop(self):
+        while True:
+            time.sleep(self.log_interval)
+            self.log_summary()
+
+
+def profile_app(app, force=False):
+    """Attach a CallbackProfiler if DASH_PROFILE=1 (or force), returns it or None."""
+    if not (force or os.environ.get('DASH_PROFILE') == '1'):
+        return None
+    logging.basicConfig(level=logging.INFO)
+    return CallbackProfiler(app, log_interval=float(os.environ.get('DASH_PROFILE_INTERVAL', 60)))
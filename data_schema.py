@@ -0,0 +1,90 @@
+# Compact schema for the prepared datasets, applied by data_prep.ipynb right before the export
+#
+#   strings     low-cardinality columns (country, continent, alpha-3, DEST, ORIGIN, ...)
+#               become categoricals: stored as small integer codes, == / isin compare codes
+#   integers    downcast to the smallest integer type that holds them (year -> int16)
+#   floats      whole-number columns without NaN become integers (population), the rest stay
+#               float64: they end up in hover texts, float32 would show as 55.68000030517578
+#   drop        redundant columns, e.g. the HHMM time columns the datetimes were built from
+#
+# The rules above look at the values, so a table written in partitions (the flights by
+# year) would get a different dtype per year wherever a year happens to have no NaN or
+# only small values. Those tables get a fixed schema instead, the same for every partition:
+#
+#   data_join_arr, report = apply_schema(data_join_arr, drop=DERIVED_TIME_COLUMNS, schema=FLIGHT_SCHEMA)
+import numpy as np
+import pandas as pd
+
+from flight_ingest import CSV_DTYPES
+from flight_prep import DATETIME_COLUMNS
+
+# the HHMM columns (CRS_DEP_TIME, DEP_TIME, ...) that only fed the *_DATETIME columns
+DERIVED_TIME_COLUMNS = list(DATETIME_COLUMNS.values())
+
+# the flight tables: airport codes as categoricals, the airport keys (airport_dim.py) and the
+# numbers in the dtypes pinned at ingest (flight_ingest.CSV_DTYPES), datetimes as they are
+FLIGHT_SCHEMA = {
+    'ORIGIN': 'category',
+    'DEST': 'category',
+    'ORIGIN_KEY': 'int32',
+    'DEST_KEY': 'int32',
+    **{column: dtype for column, dtype in CSV_DTYPES.items() if dtype != 'str'},
+}
+
+# strings with at most this many distinct values per row become categoricals
+MAX_CATEGORY_RATIO = 0.5
+
+
+def memory_mb(df):
+    return df.memory_usage(deep=True, index=False).sum() / 1e6
+
+
+def compact_column(series, max_category_ratio=MAX_CATEGORY_RATIO):
+    """The column in the smallest dtype that keeps its values."""
+    if series.dtype == object:
+        if series.nunique(dropna=True) <= max_category_ratio * max(len(series), 1):
+            return series.astype('category')
+        return series
+    if series.dtype.kind in 'iu':
+        return pd.to_numeric(series, downcast='integer')
+    if series.dtype.kind == 'f':
+        values = series.to_numpy()
+        if len(values) and not np.isnan(values).any() and np.array_equal(values, np.round(values)):
+            return pd.to_numeric(series.astype(np.int64), downcast='integer')
+    return series
+
+
+def apply_schema(df, drop=(), schema=None, max_category_ratio=MAX_CATEGORY_RATIO):
+    """Compact copy of df without the `drop` columns, and a report {column: (old dtype, new dtype)}.
+
+    schema: {column: dtype} for columns that get a fixed dtype instead of the value-based rules.
+    """
+    df = df.drop(columns=[column for column in drop if column in df.columns])
+    schema = schema or {}
+    compact = {column: series.astype(schema[column]) if column in schema else compact_column(series, max_category_ratio)
+               for column, series in df.items()}
+    report = {column: (str(df[column].dtype), str(series.dtype))
+              for column, series in compact.items() if series.dtype != df[column].dtype}
+    return pd.DataFrame(compact, index=df.index), report
+
+
+def schema_report(datasets, drop=(), schema=None):
+    """Apply the schema to {name: df}, returns the compact frames and one report row per dataset.
+
+    The report has the memory before / after (MB, strings counted in full), the saving and
+    the changed / dropped columns.
+    """
+    compact, rows = {}, []
+    for name, df in datasets.items():
+        compact[name], changed = apply_schema(df, drop, schema)
+        before, after = memory_mb(df), memory_mb(compact[name])
+        rows.append({
+            'dataset': name,
+            'rows': len(df),
+            'before_mb': round(before, 2),
+            'after_mb': round(after, 2),
+            'saved_pct': round(100 * (1 - after / before), 1) if before else 0.0,
+            'dropped': [column for column in drop if column in df.columns],
+            'changed': {column: f'{old} -> {new}' for column, (old, new) in changed.items()},
+        })
+    return compact, pd.DataFrame(rows).set_index('dataset')
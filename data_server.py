@@ -0,0 +1,139 @@
+# Shared datasets for multi-worker deployments (Gunicorn)
+#
+#   DASH_SHARED_DATA=1 gunicorn -w 8 Dashboard_LE4_fast:server
+#
+# Without it every worker reads its own copy of the table and type-converts it. In the shared
+# mode the first worker loads and converts the dataset once and publishes the result as a store
+# table in shared memory (/dev/shm/dash_data, the temp dir where there is no /dev/shm,
+# DASH_SHARED_DATA_DIR to change). All workers then
+# attach to it: every column, including the codes of the string columns (published as
+# categoricals), is a read-only memory map of the same pages, so memory stays about constant
+# when workers are added and attaching is a few file opens.
+#
+#   df_gdp = load_table('data_gapminder', columns=[...], prepare=int_year)
+#
+# The shared copy is rebuilt when the content of the source table changed (its hash is kept
+# next to the copy). It can also be published before the workers start:
+#
+#   python data_server.py data_gapminder_join --columns year continent country ... --prepare int_year
+import argparse
+import hashlib
+import os
+import tempfile
+
+from data_store import STORE_ROOT, read_table, table_hash, table_path, write_table
+
+# tmpfs on Linux, the temp dir (a page cache backed file, still shared) elsewhere
+SHARED_ROOT = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'dash_data')
+
+
+def shared_enabled():
+    return os.environ.get('DASH_SHARED_DATA') == '1'
+
+
+def shared_root():
+    return os.environ.get('DASH_SHARED_DATA_DIR', SHARED_ROOT)
+
+
+# conversions applied once before publishing, by name for the command line
+def int_year(df):
+    df['year'] = df['year'].astype(int)
+    return df
+
+
+def arrivals_by_time(df):
+    # flight delay view: only flights with a delay, sorted for the binary search on zoom
+    return df.dropna(subset=['ARR_DELAY']).sort_values('ARR_DATETIME', kind='stable')
+
+
+PREPARE = {'int_year': int_year, 'arrivals_by_time': arrivals_by_time}
+
+
+def shared_name(name, columns=None, prepare=None):
+    # one shared table per source table, column selection and conversion
+    spec = repr((name, columns, prepare and prepare.__qualname__))
+    return f"{name}-{hashlib.sha1(spec.encode()).hexdigest()[:10]}"
+
+
+def prepare_table(name, columns=None, prepare=None, root=STORE_ROOT):
+    """Load a table into memory and apply `prepare` (type conversion, sorting, ...)."""
+    df = read_table(name, columns=columns, root=root, mmap=False)
+    if prepare is not None:
+        df = prepare(df)
+    return df.reset_index(drop=True)
+
+
+def publish(name, columns=None, prepare=None, root=STORE_ROOT, shared=None):
+    """Write the prepared table to shared memory, returns the shared table name."""
+    shared = shared or shared_root()
+    df = prepare_table(name, columns, prepare, root)
+    # string columns become categoricals, their codes can be memory-mapped like the numbers
+    for column, series in df.items():
+        if series.dtype == object:
+            df[column] = series.astype('category')
+    key = shared_name(name, columns, prepare)
+    write_table(df, key, root=shared)
+    # the source the copy was made from, written last: an interrupted publish is not current
+    tmp = _source_path(key, shared) + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(table_hash(name, root))
+    os.replace(tmp, _source_path(key, shared))
+    return key
+
+
+def _source_path(key, shared):
+    return os.path.join(shared, key + '.source')
+
+
+def _is_current(name, key, root, shared):
+    # by content, the mtimes of a copied or restored store say nothing
+    try:
+        with open(_source_path(key, shared)) as f:
+            source = f.read()
+    except FileNotFoundError:
+        return False
+    return os.path.isdir(table_path(key, shared)) and source == table_hash(name, root)
+
+
+def attach(name, columns=None, prepare=None, root=STORE_ROOT, shared=None):
+    """Memory-map the shared copy of a table, publishing it first if it is missing or stale."""
+    # only the shared mode needs the lock, the private copies also work where there is no fcntl
+    import fcntl
+
+    shared = shared or shared_root()
+    os.makedirs(shared, exist_ok=True)
+    key = shared_name(name, columns, prepare)
+    # one worker publishes, the others wait for it instead of loading the table too
+    with open(os.path.join(shared, key + '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not _is_current(name, key, root, shared):
+                publish(name, columns, prepare, root, shared)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return read_table(key, root=shared, mmap=True)
+
+
+def load_table(name, columns=None, prepare=None, root=STORE_ROOT):
+    """The dashboards' data loader: shared memory with DASH_SHARED_DATA=1, a private copy otherwise."""
+    if shared_enabled():
+        return attach(name, columns, prepare, root)
+    return prepare_table(name, columns, prepare, root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Publish a store table to shared memory for the Dash workers')
+    parser.add_argument('name', help='store table, e.g. data_gapminder_join')
+    parser.add_argument('--columns', nargs='+')
+    parser.add_argument('--prepare', choices=list(PREPARE))
+    parser.add_argument('--root', default=STORE_ROOT)
+    parser.add_argument('--shared', default=shared_root())
+    args = parser.parse_args()
+
+    key = publish(args.name, args.columns, PREPARE.get(args.prepare), root=args.root, shared=args.shared)
+    df = read_table(key, root=args.shared)
+    print(f"{args.name}: {len(df):,} rows, {df.memory_usage(deep=False).sum() / 1e6:.1f} MB in {table_path(key, args.shared)}")
+
+
+if __name__ == '__main__':
+    main()
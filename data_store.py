@@ -0,0 +1,309 @@
+# Columnar on-disk store for the prepared datasets (replaces the monolithic .pkl files)
+#
+# Every column is one .npy file, so a reader only touches the columns it asks for and
+# numeric / datetime columns are memory-mapped instead of loaded. String columns are
+# stored as integer codes plus a json list of their categories.
+#
+#   store/data_gapminder_join/_meta.json
+#   store/data_gapminder_join/year.npy
+#   store/data_gapminder_join/country.codes.npy + country.categories.json
+#
+# Partitioned tables (the flights by year) have one such folder per partition:
+#
+#   store/flight_data_arr/2018/_meta.json, ARR_DELAY.npy, ...
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+STORE_ROOT = 'store'
+META_FILE = '_meta.json'
+
+
+def _column_kind(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return 'category'
+    if series.dtype.kind in 'biufcmM':
+        return 'numpy'
+    return 'string'
+
+
+def _write_columns(df, folder):
+    tmp = folder + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    columns = {}
+    for column, series in df.items():
+        kind = _column_kind(series)
+        if kind == 'numpy':
+            np.save(os.path.join(tmp, f'{column}.npy'), series.to_numpy())
+        else:
+            # strings are written as codes + categories, -1 marks missing values
+            categorical = series.values if kind == 'category' else pd.Categorical(series)
+            np.save(os.path.join(tmp, f'{column}.codes.npy'), np.asarray(categorical.codes))
+            with open(os.path.join(tmp, f'{column}.categories.json'), 'w') as f:
+                json.dump(categorical.categories.tolist(), f)
+        columns[column] = {'kind': kind, 'dtype': str(series.dtype)}
+
+    with open(os.path.join(tmp, META_FILE), 'w') as f:
+        json.dump({'columns': columns, 'rows': len(df)}, f)
+
+    # swap in the finished folder, readers never see a half written table
+    shutil.rmtree(folder, ignore_errors=True)
+    os.replace(tmp, folder)
+
+
+def _read_columns(folder, columns=None, mmap=True):
+    with open(os.path.join(folder, META_FILE)) as f:
+        meta = json.load(f)
+    columns = list(meta['columns']) if columns is None else columns
+    mmap_mode = 'r' if mmap else None
+
+    data = {}
+    for column in columns:
+        kind = meta['columns'][column]['kind']
+        if kind == 'numpy':
+            data[column] = np.load(os.path.join(folder, f'{column}.npy'), mmap_mode=mmap_mode)
+        else:
+            codes = np.load(os.path.join(folder, f'{column}.codes.npy'), mmap_mode=mmap_mode)
+            with open(os.path.join(folder, f'{column}.categories.json')) as f:
+                categories = json.load(f)
+            values = pd.Categorical.from_codes(codes, categories)
+            data[column] = values if kind == 'category' else values.astype(object)
+    # copy=False keeps the memory-mapped columns as they are
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+def _parse_key(key):
+    return int(key) if key.lstrip('-').isdigit() else key
+
+
+def table_path(name, root=STORE_ROOT):
+    return os.path.join(root, name)
+
+
+def write_table(df, name, partition_by=None, root=STORE_ROOT):
+    """Write a DataFrame as table `name`.
+
+    partition_by can be a column name or a Series with one partition key per row
+    (e.g. df['ARR_DATETIME'].dt.year), every key gets its own folder.
+    """
+    df = df.reset_index(drop=True)
+    folder = table_path(name, root)
+    if partition_by is None:
+        _write_columns(df, folder)
+        return
+
+    keys = df[partition_by] if isinstance(partition_by, str) else pd.Series(np.asarray(partition_by))
+    shutil.rmtree(folder, ignore_errors=True)
+    for key, positions in keys.groupby(keys, sort=True).indices.items():
+        write_partition(df.take(positions), name, key, root)
+
+
+def write_partition(df, name, key, root=STORE_ROOT):
+    """Write (or replace) the single partition `key` of table `name`."""
+    folder = table_path(name, root)
+    os.makedirs(folder, exist_ok=True)
+    _write_columns(df.reset_index(drop=True), os.path.join(folder, str(key)))
+
+
+class PartitionWriter:
+    """Writes the partition `key` of table `name` chunk by chunk.
+
+    Every append is stored as its own sub-folder; close() merges them column by column
+    into memory-mapped files, so the peak is one chunk (or one column of the partition),
+    never the whole partition:
+
+        with PartitionWriter('flight_data_arr', 2018) as writer:
+            for chunk in chunks:
+                writer.append(chunk)
+    """
+
+    def __init__(self, name, key, root=STORE_ROOT):
+        self.folder = os.path.join(table_path(name, root), str(key))
+        self.parts_dir = self.folder + '.parts'
+        self.parts = []
+        self.rows = 0
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+        os.makedirs(self.parts_dir)
+
+    def append(self, df):
+        if not len(df):
+            return
+        part = os.path.join(self.parts_dir, f'{len(self.parts):06d}')
+        _write_columns(df.reset_index(drop=True), part)
+        self.parts.append(part)
+        self.rows += len(df)
+
+    def close(self, columns=None):
+        """Merge the chunks into the partition; without any chunk it gets the given columns and no rows."""
+        if not self.parts:
+            _write_columns(pd.DataFrame(columns=columns), self.folder)
+        else:
+            self._merge()
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+    def _merge(self):
+        with open(os.path.join(self.parts[0], META_FILE)) as f:
+            columns = json.load(f)['columns']
+        tmp = self.folder + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        for column, info in columns.items():
+            if info['kind'] == 'numpy':
+                arrays = [np.load(os.path.join(part, f'{column}.npy'), mmap_mode='r') for part in self.parts]
+                out = np.lib.format.open_memmap(os.path.join(tmp, f'{column}.npy'), mode='w+',
+                                                dtype=np.result_type(*arrays), shape=(self.rows,))
+                _fill(out, arrays)
+                info['dtype'] = str(out.dtype)
+            else:
+                # every chunk has its own categories, map the codes onto their union
+                chunk_categories = []
+                for part in self.parts:
+                    with open(os.path.join(part, f'{column}.categories.json')) as f:
+                        chunk_categories.append(json.load(f))
+                categories = pd.Index([c for chunk in chunk_categories for c in chunk]).unique()
+                dtype = pd.Categorical.from_codes([], categories).codes.dtype
+                out = np.lib.format.open_memmap(os.path.join(tmp, f'{column}.codes.npy'), mode='w+',
+                                                dtype=dtype, shape=(self.rows,))
+                start = 0
+                for part, chunk in zip(self.parts, chunk_categories):
+                    chunk_codes = np.load(os.path.join(part, f'{column}.codes.npy'))
+                    # -1 (missing) stays -1: the lookup gets it as its last entry
+                    lookup = np.append(categories.get_indexer(chunk), -1).astype(dtype)
+                    out[start:start + len(chunk_codes)] = lookup[chunk_codes]
+                    start += len(chunk_codes)
+                out.flush()
+                with open(os.path.join(tmp, f'{column}.categories.json'), 'w') as f:
+                    json.dump(categories.tolist(), f)
+            del out
+
+        with open(os.path.join(tmp, META_FILE), 'w') as f:
+            json.dump({'columns': columns, 'rows': self.rows}, f)
+        shutil.rmtree(self.folder, ignore_errors=True)
+        os.replace(tmp, self.folder)
+
+
+def _fill(out, arrays):
+    start = 0
+    for array in arrays:
+        out[start:start + len(array)] = array
+        start += len(array)
+    out.flush()
+
+
+def _missing(name, root):
+    return FileNotFoundError(f'no table {name!r} in the store {os.path.abspath(root)!r}')
+
+
+def _no_partitions(name, root):
+    return FileNotFoundError(f'table {name!r} in the store {os.path.abspath(root)!r} has no partitions')
+
+
+def list_partitions(name, root=STORE_ROOT):
+    """Sorted partition keys of a table, [] for unpartitioned tables."""
+    folder = table_path(name, root)
+    if os.path.exists(os.path.join(folder, META_FILE)):
+        return []
+    if not os.path.isdir(folder):
+        raise _missing(name, root)
+    keys = [_parse_key(entry) for entry in os.listdir(folder)
+            if not entry.endswith('.tmp') and os.path.exists(os.path.join(folder, entry, META_FILE))]
+    return sorted(keys)
+
+
+def table_hash(name, root=STORE_ROOT):
+    """Content hash of a stored table (meta and column files of every partition), None if missing.
+
+    Unlike the folder mtime it stays the same when the store is copied to another machine.
+    """
+    folder = table_path(name, root)
+    if not os.path.isdir(folder):
+        return None
+    digest = hashlib.sha1()
+    for key in list_partitions(name, root) or [None]:
+        part = folder if key is None else os.path.join(folder, str(key))
+        for entry in sorted(os.listdir(part)):
+            digest.update(f'{key}/{entry}'.encode())
+            with open(os.path.join(part, entry), 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def list_columns(name, root=STORE_ROOT):
+    """Column names of a table without loading any data."""
+    folder = table_path(name, root)
+    keys = list_partitions(name, root)
+    if keys:
+        folder = os.path.join(folder, str(keys[0]))
+    elif not os.path.exists(os.path.join(folder, META_FILE)):
+        raise _no_partitions(name, root)
+    with open(os.path.join(folder, META_FILE)) as f:
+        return list(json.load(f)['columns'])
+
+
+def _empty_columns(folder, columns=None):
+    # no rows, but the columns and dtypes stored in `folder`
+    with open(os.path.join(folder, META_FILE)) as f:
+        meta = json.load(f)
+    columns = list(meta['columns']) if columns is None else columns
+    data = {}
+    for column in columns:
+        kind = meta['columns'][column]['kind']
+        if kind == 'numpy':
+            data[column] = np.empty(0, dtype=meta['columns'][column]['dtype'])
+        elif kind == 'category':
+            with open(os.path.join(folder, f'{column}.categories.json')) as f:
+                data[column] = pd.Categorical([], categories=json.load(f))
+        else:
+            data[column] = np.empty(0, dtype=object)
+    return pd.DataFrame(data, columns=columns)
+
+
+def read_table(name, columns=None, partitions=None, root=STORE_ROOT, mmap=True):
+    """Load table `name`, only the given columns and (for partitioned tables) partition keys.
+
+    Partition keys that are not stored are skipped; when none is left the result is an
+    empty frame with the stored columns and dtypes. A missing table, or one without any
+    partition, raises FileNotFoundError naming the table and the store.
+
+    Numeric and datetime columns are memory-mapped read-only unless mmap=False.
+    """
+    folder = table_path(name, root)
+    if os.path.exists(os.path.join(folder, META_FILE)):
+        return _read_columns(folder, columns, mmap)
+
+    stored = list_partitions(name, root)
+    if not stored:
+        raise _no_partitions(name, root)
+    keys = stored if partitions is None else [key for key in partitions if _parse_key(str(key)) in stored]
+    if not keys:
+        # nothing selected, an empty frame with the schema of the stored partitions
+        return _empty_columns(os.path.join(folder, str(stored[0])), columns)
+    frames = [_read_columns(os.path.join(folder, str(key)), columns, mmap) for key in keys]
+    if len(frames) == 1:
+        return frames[0]
+
+    # every partition has its own categories, align them so concat keeps the categorical dtype
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            categories = union_categoricals([frame[column] for frame in frames]).categories
+            for frame in frames:
+                frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,116 @@
+# Downsampling of large time series before they are handed to Plotly
+#
+# A line or scatter plot can not show more than a few points per pixel column, so
+# instead of sending hundreds of thousands of ARR_DATETIME / ARR_DELAY points the
+# series is reduced to a point budget derived from the plot width:
+#
+#   lttb    Largest-Triangle-Three-Buckets, keeps the visual shape of a line
+#   minmax  min and max of every pixel column, keeps every spike (delays!)
+#
+# Both work on x sorted ascending and return the positions of the points to keep.
+import numpy as np
+
+METHODS = ('lttb', 'minmax')
+
+
+def _as_float(x):
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def point_budget(width_px, method='minmax', points_per_px=1):
+    """Number of points to keep for a plot that is width_px pixels wide."""
+    budget = int(width_px * points_per_px)
+    return budget * 2 if method == 'minmax' else budget
+
+
+def lttb(x, y, n_out):
+    """Positions of the n_out points picked by Largest-Triangle-Three-Buckets.
+
+    The bucket loop is inherent to LTTB (every bucket depends on the point picked in the
+    previous one), the work inside a bucket is vectorized.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = _as_float(x)
+    y = np.asarray(y, dtype=np.float64)
+
+    # first and last point are always kept, the rest is split into n_out - 2 buckets
+    edges = (np.linspace(0, n - 2, n_out - 1) + 1).astype(np.int64)
+    # average point of every bucket, used as the third triangle corner of the previous bucket
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        cx, cy = avg_x[bucket + 1], avg_y[bucket + 1]
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - cx) * (y[start:end] - ay) - (ax - x[start:end]) * (cy - ay))
+        a = start + int(np.argmax(area))
+        selected[bucket + 1] = a
+    return selected
+
+
+def minmax(x, y, n_buckets):
+    """Positions of the min and max point of n_buckets equally wide x ranges (fully vectorized)."""
+    n = len(y)
+    if n <= 2 * n_buckets:
+        return np.arange(n)
+    xf = _as_float(x)
+    y = np.asarray(y, dtype=np.float64)
+
+    span = xf[-1] - xf[0]
+    if span == 0:
+        bucket = np.zeros(n, dtype=np.int64)
+    else:
+        bucket = np.minimum(((xf - xf[0]) / span * n_buckets).astype(np.int64), n_buckets - 1)
+
+    # x is sorted, so every (non empty) bucket is a contiguous run of rows
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    counts = np.diff(np.r_[starts, n])
+    run = np.repeat(np.arange(len(starts)), counts)
+    keep = []
+    for reduce in (np.minimum, np.maximum):
+        extreme = np.repeat(reduce.reduceat(y, starts), counts)
+        hits = np.flatnonzero(y == extreme)
+        # first row of every run that reaches the extreme
+        _, first = np.unique(run[hits], return_index=True)
+        keep.append(hits[first])
+    return np.unique(np.concatenate(keep))
+
+
+def downsample(x, y, n_out, method='minmax'):
+    """Reduce (x, y) to about n_out points. x must be sorted ascending, NaN in y are dropped.
+
+    Returns the reduced x and y arrays.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    valid = ~np.isnan(y.astype(np.float64))
+    if not valid.all():
+        x, y = x[valid], y[valid]
+    if method == 'lttb':
+        keep = lttb(x, y, n_out)
+    elif method == 'minmax':
+        keep = minmax(x, y, max(n_out // 2, 1))
+    else:
+        raise ValueError(f"unknown downsampling method {method!r}, use one of {METHODS}")
+    return x[keep], y[keep]
+
+
+def visible_range(x, x0=None, x1=None):
+    """Slice of the sorted array x that lies within [x0, x1] (None = open end)."""
+    x = np.asarray(x)
+    start = 0 if x0 is None else np.searchsorted(x, np.asarray(x0, dtype=x.dtype), side='left')
+    end = len(x) if x1 is None else np.searchsorted(x, np.asarray(x1, dtype=x.dtype), side='right')
+    return slice(int(start), int(end))
@@ -0,0 +1,293 @@
+# Memoized figures for the dashboard callbacks
+#
+# The filter space of the dashboards is small (years x continents x countries) and users
+# scrub the slider back and forth, so the figures are cached by their normalized callback
+# inputs:
+#
+#   figure_cache = FigureCache(maxsize=512, watch=[table_path('data_gapminder_join')])
+#
+#   @app.callback(...)
+#   @figure_cache.cached
+#   def update_scatter(selected_year, selected_continent, selected_country): ...
+#
+# The in-process tier is a size-bounded LRU. With disk_dir (or FIGURE_CACHE_DIR) set,
+# figures are also pickled there, so several Gunicorn workers share the rendered figures.
+# When one of the watched files / store tables changes, all cached figures become stale.
+#
+# With prefetch, serving a callback also warms the calls the user most likely makes next
+# (the neighbouring slider years). Building a figure is CPU bound and holds the GIL, so the
+# prefetch must not run next to the requests it is meant to speed up: the calls are queued
+# only once the response has been sent, a single background thread runs one of them at a
+# time, and only while no cached callback is being served. Under constant load nothing is
+# prefetched, the queue keeps the most recent calls:
+#
+#   @figure_cache.cached(prefetch=lambda year, continent: [(y, continent) for y in neighbors(years, year)])
+import functools
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+from flask import after_this_request, has_request_context
+
+logger = logging.getLogger('figure_cache')
+
+# the disk tier is trimmed to disk_maxsize every this many writes of a process, not on each
+# one (listing the directory costs more than the write); it may overshoot by this much per worker
+DISK_PRUNE_INTERVAL = 64
+
+# queued prefetch calls, the oldest are dropped beyond this
+PREFETCH_QUEUE = 8
+
+
+def normalize(value):
+    """Turn callback inputs into a stable, json serializable form (1957.0 == 1957, lists ignore order)."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, (list, tuple)):
+        return sorted((normalize(v) for v in value), key=repr)
+    if isinstance(value, dict):
+        return {str(k): normalize(v) for k, v in sorted(value.items())}
+    return value
+
+
+def neighbors(values, value, distance=1):
+    """The values next to `value` in the sorted `values` (e.g. slider marks), nearest first."""
+    values = np.asarray(values)
+    left = np.searchsorted(values, value, side='left')
+    right = np.searchsorted(values, value, side='right')
+    result = []
+    for step in range(distance):
+        if right + step < len(values):
+            result.append(values[right + step].item())
+        if left - step - 1 >= 0:
+            result.append(values[left - step - 1].item())
+    return result
+
+
+class FigureCache:
+    def __init__(self, maxsize=256, disk_dir=None, disk_maxsize=10_000, watch=(), prefetch=True):
+        self.maxsize = maxsize
+        self.disk_dir = disk_dir if disk_dir is not None else os.environ.get('FIGURE_CACHE_DIR')
+        self.disk_maxsize = disk_maxsize
+        self.watch = list(watch)
+        self.prefetch_enabled = prefetch
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._active = 0
+        self._queue = OrderedDict()
+        self._running = {}
+        self._worker = None
+        self._local = threading.local()
+        self._disk_writes = 0
+        self._stamp = self._data_stamp()
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _data_stamp(self):
+        # store tables are swapped in as new folders, so their mtime changes on every write
+        stamp = []
+        for path in self.watch:
+            try:
+                stamp.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                stamp.append(None)
+        return stamp
+
+    def check(self):
+        """Drop the in-process figures if a watched data file changed since they were built."""
+        stamp = self._data_stamp()
+        if stamp != self._stamp:
+            with self._lock:
+                self._memory.clear()
+                self._stamp = stamp
+
+    def invalidate(self):
+        """Drop all cached figures (both tiers)."""
+        with self._lock:
+            self._memory.clear()
+        if self.disk_dir:
+            for entry in os.listdir(self.disk_dir):
+                if entry.endswith('.pkl'):
+                    os.remove(os.path.join(self.disk_dir, entry))
+
+    def key(self, name, args):
+        # the data stamp is part of the key, so stale figures on disk simply never match again
+        payload = json.dumps([name, [normalize(a) for a in args], self._stamp], default=repr)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return True, self._memory[key]
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), 'rb') as f:
+                    value = pickle.load(f)
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                return False, None
+            self._remember(key, value)
+            return True, value
+        return False, None
+
+    def put(self, key, value):
+        self._remember(key, value)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+            with self._lock:
+                self._disk_writes += 1
+                prune = self._disk_writes % DISK_PRUNE_INTERVAL == 0
+            if prune:
+                self._prune_disk()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + '.pkl')
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.maxsize:
+                self._memory.popitem(last=False)
+
+    def _prune_disk(self):
+        entries = [os.path.join(self.disk_dir, e) for e in os.listdir(self.disk_dir) if e.endswith('.pkl')]
+        if len(entries) <= self.disk_maxsize:
+            return
+        entries.sort(key=lambda path: os.stat(path).st_mtime)
+        for path in entries[:len(entries) - self.disk_maxsize]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def prefetch(self, key, func, args):
+        """Queue func(*args) to be computed into the cache in the background, unless cached or queued."""
+        # rendered by another worker: get() loads it from disk when it is asked for
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            return
+        with self._lock:
+            if key in self._memory or key in self._running:
+                return
+            self._queue[key] = (func, args)
+            self._queue.move_to_end(key)
+            while len(self._queue) > PREFETCH_QUEUE:
+                self._queue.popitem(last=False)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._prefetch_loop, name='figure-prefetch', daemon=True)
+                self._worker.start()
+            self._idle.notify_all()
+
+    def _prefetch_loop(self):
+        # prefetched calls do not prefetch again
+        self._local.prefetching = True
+        while True:
+            with self._lock:
+                while not self._queue or self._active:
+                    self._idle.wait()
+                # the most recent request first, the user is still there
+                key, (func, args) = self._queue.popitem(last=True)
+                future = self._running[key] = Future()
+            try:
+                value = func(*args)
+                self.put(key, value)
+                future.set_result(value)
+                with self._lock:
+                    self.prefetched += 1
+            except Exception as e:
+                logger.exception('prefetch of %s failed', key)
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._running.pop(key, None)
+
+    def _after_response(self, calls):
+        def queue():
+            for key, func, args in calls:
+                self.prefetch(key, func, args)
+
+        if not has_request_context():
+            queue()
+            return
+
+        # after_this_request runs before the response is sent, call_on_close once it is out
+        @after_this_request
+        def defer(response):
+            response.call_on_close(queue)
+            return response
+
+    def _lookup(self, key, func, args):
+        found, value = self.get(key)
+        if found:
+            with self._lock:
+                self.hits += 1
+            return value
+        with self._lock:
+            # no point in prefetching it any more
+            self._queue.pop(key, None)
+            running = self._running.get(key)
+        if running is not None:
+            # being prefetched right now, wait for it instead of computing it twice
+            try:
+                value = running.result()
+                with self._lock:
+                    self.hits += 1
+                return value
+            except Exception:
+                pass
+        with self._lock:
+            self.misses += 1
+        value = func(*args)
+        self.put(key, value)
+        return value
+
+    def cached(self, func=None, *, key_args=None, prefetch=None):
+        """Decorator, caches the return value of a callback by its normalized arguments.
+
+        key_args: positions of the arguments that make up the key (default: all of them),
+        e.g. to leave out a State that does not change the figure.
+        prefetch: called with the callback arguments, returns the argument tuples to warm
+        in the background once the response is sent (disabled with FigureCache(prefetch=False)).
+        """
+        if func is None:
+            return functools.partial(self.cached, key_args=key_args, prefetch=prefetch)
+
+        name = f'{func.__module__}.{func.__qualname__}'
+
+        def make_key(args):
+            return self.key(name, args if key_args is None else [args[i] for i in key_args])
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            self.check()
+            key = make_key(args)
+            with self._lock:
+                self._active += 1
+            try:
+                value = self._lookup(key, func, args)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    if not self._active:
+                        self._idle.notify_all()
+            if prefetch is not None and self.prefetch_enabled and not getattr(self._local, 'prefetching', False):
+                self._after_response([(make_key(next_args), func, next_args) for next_args in prefetch(*args)])
+            return value
+
+        return wrapper
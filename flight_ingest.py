@@ -0,0 +1,123 @@
+# Chunked, parallel ingest of the yearly BTS flight csv files (Data/<year>.csv)
+#
+# Every year is read in chunks with only the needed columns and pinned dtypes,
+# rows without times are dropped while streaming, the datetimes are built per chunk
+# and every chunk goes straight to disk, merged into one partition per year in the
+# columnar store (data_store.PartitionWriter). A worker holds one chunk, not the year:
+#
+#   store/ingest/flight_data_dep/2018/
+#   store/ingest/flight_data_arr/2018/
+#
+# The delay rollups (flight_rollup.py) and the time pyramid (time_pyramid.py) of every year
+# are computed afterwards from the memory-mapped airport / time / delay columns of the new
+# partitions and written to the store next to the final tables, so the dashboards find them
+# whether the store was built by this script or by prep_pipeline.py.
+#
+# python flight_ingest.py 2014 2015 2016 2017 2018 --workers 4
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from data_store import STORE_ROOT, PartitionWriter, read_table
+from flight_prep import DATETIME_COLUMNS, build_datetimes
+from flight_rollup import ROLLUPS, write_rollups
+from time_pyramid import write_pyramid
+
+INGEST_ROOT = os.path.join(STORE_ROOT, 'ingest')
+
+TIME_COLUMNS = list(DATETIME_COLUMNS.values())
+
+# the only columns read from the csv, everything else (delay reasons, cancellations, ...) is never parsed
+CSV_DTYPES = {
+    'FL_DATE': 'str',
+    'ORIGIN': 'str',
+    'DEST': 'str',
+    'CRS_DEP_TIME': 'float32',
+    'DEP_TIME': 'float32',
+    'DEP_DELAY': 'float32',
+    'WHEELS_OFF': 'float32',
+    'WHEELS_ON': 'float32',
+    'CRS_ARR_TIME': 'float32',
+    'ARR_TIME': 'float32',
+    'ARR_DELAY': 'float32',
+    'CRS_ELAPSED_TIME': 'float32',
+    'ACTUAL_ELAPSED_TIME': 'float32',
+    'AIR_TIME': 'float32',
+    'DISTANCE': 'float32',
+}
+
+DEP_COLUMNS = ['ORIGIN', 'CRS_DEP_TIME', 'DEP_TIME', 'DEP_DELAY', 'DEP_DATETIME', 'WHEELS_OFF', 'ACTUAL_DEP_DATETIME', 'CRS_ELAPSED_TIME', 'ACTUAL_ELAPSED_TIME', 'AIR_TIME', 'DISTANCE']
+ARR_COLUMNS = ['ARR_DATETIME', 'ARR_DELAY', 'DEST', 'CRS_ARR_TIME', 'ARR_TIME', 'WHEELS_ON', 'ACTUAL_ARR_DATETIME', 'CRS_ELAPSED_TIME', 'ACTUAL_ELAPSED_TIME', 'AIR_TIME', 'DISTANCE']
+
+PARTITIONS = {'flight_data_dep': DEP_COLUMNS, 'flight_data_arr': ARR_COLUMNS}
+
+AIRPORT_DROP = ["url", "county", "icao", "city_code", "time_zone_id", "name", "elevation"]
+
+
+def read_airports(data_dir='Data'):
+    """Airport attributes keyed by `code`, without the columns the analyses never use."""
+    return pd.read_csv(os.path.join(data_dir, 'Airports', 'airports.csv')).drop(AIRPORT_DROP, axis=1)
+
+
+def read_flight_chunks(path, chunksize=500_000, datetimes=True):
+    """Yield cleaned chunks of one BTS csv with the datetime columns already built (unless datetimes=False)."""
+    reader = pd.read_csv(path, usecols=list(CSV_DTYPES), dtype=CSV_DTYPES, chunksize=chunksize)
+    for chunk in reader:
+        chunk = chunk.dropna(subset=TIME_COLUMNS)
+        if len(chunk):
+            yield build_datetimes(chunk) if datetimes else chunk
+
+
+def ingest_year(year, data_dir='Data', out_dir=INGEST_ROOT, chunksize=500_000, rollup_dir=STORE_ROOT):
+    """Ingest Data/<year>.csv, write the dep/arr partitions, rollups and pyramid of that year, returns the row count."""
+    writers = {name: PartitionWriter(name, year, root=out_dir) for name in PARTITIONS}
+    for chunk in read_flight_chunks(os.path.join(data_dir, f'{year}.csv'), chunksize):
+        for name, columns in PARTITIONS.items():
+            writers[name].append(chunk[columns])
+    for name, writer in writers.items():
+        writer.close(columns=PARTITIONS[name])
+
+    if rollup_dir is not None:
+        # only the columns the rollups and pyramids group by, memory-mapped
+        directions = {direction: read_table(f'flight_data_{direction}', columns=list(ROLLUPS[direction][:3]),
+                                             partitions=[year], root=out_dir)
+                      for direction in ('arr', 'dep')}
+        airports = read_airports(data_dir) if os.path.exists(os.path.join(data_dir, 'Airports', 'airports.csv')) else None
+        write_rollups(year, directions, airports, root=rollup_dir)
+        write_pyramid(year, directions, root=rollup_dir)
+    return writers['flight_data_arr'].rows
+
+
+def ingest(years, data_dir='Data', out_dir=INGEST_ROOT, chunksize=500_000, workers=None, rollup_dir=STORE_ROOT):
+    """Ingest several years in a process pool, one year per task. Returns {year: rows}."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {year: pool.submit(ingest_year, year, data_dir, out_dir, chunksize, rollup_dir) for year in years}
+        return {year: future.result() for year, future in futures.items()}
+
+
+def read_partitions(name, out_dir=INGEST_ROOT, years=None, columns=None):
+    """Load the ingested flight_data_dep / flight_data_arr, optionally only some years and columns."""
+    return read_table(name, columns=columns, partitions=years, root=out_dir, mmap=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest yearly BTS flight csv files into per-year partitions')
+    parser.add_argument('years', nargs='+', type=int)
+    parser.add_argument('--data-dir', default='Data')
+    parser.add_argument('--out-dir', default=INGEST_ROOT)
+    parser.add_argument('--chunksize', type=int, default=500_000)
+    parser.add_argument('--workers', type=int, default=None, help='processes, defaults to the number of cores')
+    parser.add_argument('--rollup-dir', default=STORE_ROOT, help='store of the rollups and time pyramids')
+    parser.add_argument('--no-rollups', action='store_true', help='skip the delay rollups and time pyramids')
+    args = parser.parse_args()
+
+    rollup_dir = None if args.no_rollups else args.rollup_dir
+    rows = ingest(args.years, args.data_dir, args.out_dir, args.chunksize, args.workers, rollup_dir)
+    for year, count in rows.items():
+        print(f"{year}: {count:,} flights")
+
+
+if __name__ == '__main__':
+    main()
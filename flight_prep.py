@@ -0,0 +1,46 @@
+# Vectorized helpers for the flight data prep (see data_prep.ipynb)
+import numpy as np
+import pandas as pd
+
+# datetime column -> integer HHMM column it is built from
+DATETIME_COLUMNS = {
+    'DEP_DATETIME': 'CRS_DEP_TIME',
+    'ARR_DATETIME': 'CRS_ARR_TIME',
+    'ACTUAL_DEP_DATETIME': 'DEP_TIME',
+    'ACTUAL_ARR_DATETIME': 'ARR_TIME',
+}
+
+
+def parse_dates(fl_date):
+    """Parse FL_DATE strings into datetime64[m] by parsing every distinct date only once."""
+    codes, uniques = pd.factorize(np.asarray(fl_date), sort=False)
+    days = pd.to_datetime(uniques, format='%Y-%m-%d').values.astype('datetime64[m]')
+    return days[codes]
+
+
+def hhmm_to_minutes(hhmm):
+    """Turn integer HHMM values (e.g. 1435) into minutes after midnight.
+
+    2400 becomes 1440, i.e. midnight of the following day.
+    """
+    hhmm = np.asarray(hhmm).astype(np.int64)
+    return (hhmm // 100) * 60 + hhmm % 100
+
+
+def hhmm_to_datetime(days, hhmm):
+    """Combine a datetime64 day array with integer HHMM values into datetime64[ns]."""
+    minutes = hhmm_to_minutes(hhmm).astype('timedelta64[m]')
+    return (days + minutes).astype('datetime64[ns]')
+
+
+def build_datetimes(flight_data, date_column='FL_DATE'):
+    """Add DEP_DATETIME, ARR_DATETIME, ACTUAL_DEP_DATETIME and ACTUAL_ARR_DATETIME.
+
+    The HHMM columns must not contain NaN (drop them first) and are cast to int.
+    """
+    flight_data = flight_data.copy()
+    days = parse_dates(flight_data[date_column])
+    for datetime_column, time_column in DATETIME_COLUMNS.items():
+        flight_data[time_column] = flight_data[time_column].astype(int)
+        flight_data[datetime_column] = hhmm_to_datetime(days, flight_data[time_column].values)
+    return flight_data
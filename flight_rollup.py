@@ -0,0 +1,82 @@
+# Pre-aggregated delay rollups, written by the ingest (flight_ingest.py) for every year
+#
+# Instead of grouping millions of flights for every analysis, flights / count / sum / mean / quantiles
+# of ARR_DELAY (by DEST) and DEP_DELAY (by ORIGIN) are stored per airport and
+#
+#   day     calendar day (ARR_DATETIME / DEP_DATETIME floored to the day)
+#   hour    hour of the day 0-23
+#   month   first day of the month
+#
+# together with the airport attributes (airports missing from the dimension are left out, as in
+# the flight tables), as store tables partitioned by year:
+#
+#   store/rollup_arr_by_day/2018/, store/rollup_dep_by_hour/2018/, ...
+import pandas as pd
+
+from airport_dim import airport_keys, build_dimension, lookup
+from data_store import STORE_ROOT, read_table, write_partition
+
+QUANTILES = (0.5, 0.9, 0.95)
+GRAINS = ('day', 'hour', 'month')
+
+# (airport column, time column, delay column, suffix of the joined airport attributes)
+ROLLUPS = {
+    'arr': ('DEST', 'ARR_DATETIME', 'ARR_DELAY', '_dest'),
+    'dep': ('ORIGIN', 'DEP_DATETIME', 'DEP_DELAY', '_origin'),
+}
+
+
+def rollup_name(direction, grain):
+    return f'rollup_{direction}_by_{grain}'
+
+
+def time_key(times, grain):
+    if grain == 'day':
+        return times.dt.floor('D')
+    if grain == 'hour':
+        return times.dt.hour
+    return times.dt.to_period('M').dt.to_timestamp()
+
+
+def build_rollup(flights, airport_column, time_column, delay_column, grain):
+    """flights, count, sum, mean and quantiles of delay_column per airport and time grain."""
+    keys = [flights[airport_column], time_key(flights[time_column], grain).rename(grain)]
+    grouped = flights[delay_column].groupby(keys, observed=True, sort=True)
+    # flights counts every row, count only the ones with a delay value
+    rollup = grouped.agg(['size', 'count', 'sum', 'mean']).rename(columns={'size': 'flights'})
+    quantiles = grouped.quantile(list(QUANTILES)).unstack()
+    quantiles.columns = [f'p{int(q * 100)}' for q in QUANTILES]
+    return rollup.join(quantiles).reset_index()
+
+
+def join_airports(rollup, airports, airport_column, suffix):
+    # attribute names as in the flight views (latitude_dest, state_origin, ...), looked up by airport key;
+    # an inner join like add_keys, so the rollups cover the same airports as flight_data_arr / _dep
+    dimension = build_dimension(airports)
+    keys = airport_keys(rollup[airport_column], dimension)
+    known = (keys >= 0).to_numpy()
+    rollup = rollup[known].reset_index(drop=True)
+    attributes = lookup(dimension, keys[known].reset_index(drop=True), suffix=suffix)
+    return pd.concat([rollup, attributes], axis=1)
+
+
+def write_rollups(year, frames, airports=None, root=STORE_ROOT):
+    """Write all rollups of one year. frames: {'arr': flight_data_arr, 'dep': flight_data_dep}."""
+    for direction, flights in frames.items():
+        airport_column, time_column, delay_column, suffix = ROLLUPS[direction]
+        for grain in GRAINS:
+            rollup = build_rollup(flights, airport_column, time_column, delay_column, grain)
+            if airports is not None:
+                rollup = join_airports(rollup, airports, airport_column, suffix)
+            write_partition(rollup, rollup_name(direction, grain), year, root=root)
+
+
+def read_rollup(direction, grain, columns=None, years=None, root=STORE_ROOT):
+    """Load one rollup table, e.g. read_rollup('arr', 'month', years=[2018])."""
+    return read_table(rollup_name(direction, grain), columns=columns, partitions=years, root=root, mmap=False)
+
+
+def dest_counts(years=None, root=STORE_ROOT):
+    """Number of arriving flights per destination, smallest first (replaces groupby('DEST')['DEST'].count())."""
+    rollup = read_rollup('arr', 'month', columns=['DEST', 'flights'], years=years, root=root)
+    return rollup.groupby('DEST')['flights'].sum().sort_values(ascending=True)
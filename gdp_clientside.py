@@ -0,0 +1,70 @@
+# Clientside serving mode for the gapminder dashboards
+#
+#   DASH_CLIENTSIDE=1 python Dashboard_LE4_fast.py
+#
+# The gapminder table is only a few thousand rows, so instead of filtering pandas and sending
+# a full figure for every slider move, the table is sent to the browser once per session in a
+# compact columnar form (strings as codes + categories) and kept in a session dcc.Store.
+# Year / continent / country filtering and the scatter, bar and choropleth figures are then
+# built by the clientside callbacks in assets/gapminder_clientside.js.
+#
+#   payload = encode_columns(df_gdp, ['year', 'continent', 'country', ...])
+#   register_payload(app, 'gdp-data', payload)
+#   app.clientside_callback(ClientsideFunction('gapminder', 'le3Charts'), ...)
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
+
+# floats are rounded to this many decimals, plenty for gdp / life expectancy / population
+DECIMALS = 3
+
+
+def clientside_enabled():
+    return os.environ.get('DASH_CLIENTSIDE') == '1'
+
+
+def skip_callback(*args, **kwargs):
+    """Stands in for app.callback in the clientside mode, the function stays unregistered."""
+    return lambda func: func
+
+
+def encode_column(values):
+    if isinstance(values.dtype, pd.CategoricalDtype) or values.dtype == object:
+        codes, categories = pd.factorize(values, sort=False)
+        return {'codes': codes.tolist(), 'categories': [str(c) for c in categories]}
+    if np.issubdtype(values.dtype, np.integer):
+        return values.tolist()
+    values = values.astype(np.float64).round(DECIMALS)
+    # integral floats (population) are sent as ints, NaN as null
+    return [None if np.isnan(v) else (int(v) if v.is_integer() else v) for v in values.tolist()]
+
+
+def encode_columns(df, columns, version=None):
+    """Columnar payload of df[columns] for the clientside callbacks.
+
+    Also carries the default plotly template, so the browser figures look like the px ones, and
+    a version (e.g. the store mtime) to replace session data that was loaded from older data.
+    """
+    return {
+        'version': version,
+        'rows': len(df),
+        'columns': {column: encode_column(df[column]) for column in columns},
+        'template': pio.templates[pio.templates.default].to_plotly_json(),
+    }
+
+
+def register_payload(app, store_id, payload):
+    """Fill the session store `store_id` once, later page loads in the session reuse its data."""
+    @app.callback(
+        Output(store_id, 'data'),
+        [Input(store_id, 'modified_timestamp')],
+        [State(store_id, 'data')])
+    def load_payload(timestamp, data):
+        if data is not None and data.get('version') == payload['version']:
+            raise PreventUpdate
+        return payload
+    return load_payload
@@ -0,0 +1,66 @@
+# Filter index for the gapminder dashboards
+#
+# Built once at startup: for every year, (year, continent) and (year, country) the row
+# positions are stored, so a callback filter is a dict lookup plus a take of the
+# matching rows instead of comparing whole columns on every slider move.
+import numpy as np
+import pandas as pd
+
+EMPTY = np.array([], dtype=np.intp)
+
+# default of the continent filter: rows of every continent. continent=None is a cleared
+# dropdown and, like df[df['continent'] == None], selects nothing
+ANY = object()
+
+
+class GapminderIndex:
+    def __init__(self, df):
+        # no reset_index for a default index, it would copy memory-mapped (data_server.py) columns
+        self.df = df if df.index.equals(pd.RangeIndex(len(df))) else df.reset_index(drop=True)
+        self._year = self.df.groupby('year').indices
+        self._year_continent = self.df.groupby(['year', 'continent'], observed=True).indices
+        self._year_country = self.df.groupby(['year', 'country'], observed=True).indices
+        self._continent_countries = {continent: self.df['country'].take(positions).unique()
+                                     for continent, positions in self.df.groupby('continent', observed=True).indices.items()}
+        self._years = np.sort(self.df['year'].unique())
+        self._continents = self.df['continent'].unique()
+        self._countries = self.df['country'].unique()
+        # shared tables (data_server.py) keep strings as categoricals, px expects plain columns
+        self._categorical = {column: object for column, dtype in self.df.dtypes.items()
+                             if isinstance(dtype, pd.CategoricalDtype)}
+
+    def years(self):
+        return self._years
+
+    def continents(self):
+        return self._continents
+
+    def countries(self, continent=None):
+        """All countries, or the countries of one continent (in data order)."""
+        if continent is None:
+            return self._countries
+        return self._continent_countries.get(continent, EMPTY)
+
+    def positions(self, year, continent=ANY, country=None):
+        """Row positions for a year, optionally restricted to one or more continents and a country."""
+        if continent is None:
+            return EMPTY
+        if isinstance(continent, (list, tuple)):
+            parts = [self._year_continent.get((year, c), EMPTY) for c in continent]
+            continent_positions = np.sort(np.concatenate(parts)) if parts else EMPTY
+        elif continent is not ANY:
+            continent_positions = self._year_continent.get((year, continent), EMPTY)
+
+        if country is not None:
+            country_positions = self._year_country.get((year, country), EMPTY)
+            if continent is ANY:
+                return country_positions
+            return np.intersect1d(country_positions, continent_positions, assume_unique=True)
+        if continent is not ANY:
+            return continent_positions
+        return self._year.get(year, EMPTY)
+
+    def select(self, year, continent=ANY, country=None):
+        """Rows of a year, optionally restricted to one or more continents and a country."""
+        rows = self.df.take(self.positions(year, continent, country))
+        return rows.astype(self._categorical) if self._categorical else rows
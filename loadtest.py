@@ -0,0 +1,370 @@
+# Load test: many simulated users against the callbacks of a dashboard
+#
+# Starts the dashboard in a subprocess (single process, threaded, without the debug
+# reloader) or targets a running server with --url. Every simulated client loads the app
+# like a browser (/_dash-layout, /_dash-dependencies), fires the initial callbacks and then
+# repeats user actions, posting straight to /_dash-update-component:
+#
+#   scrub    the year slider moves a few marks in one direction, one callback round per mark
+#   select   a dropdown (continent / country) gets another option
+#   page     switch between the pages of the menu (/ and /map)
+#
+# Callbacks fire the way the Dash renderer fires them: those with a changed input, those of
+# newly rendered components, and again for the props their responses changed. Clientside
+# callbacks are skipped, so with DASH_CLIENTSIDE=1 only the server callbacks are loaded.
+#
+# The report has throughput, p50 / p95 / p99 latency and response bytes per callback output
+# and the resident memory of the server (process and children) at start, peak and end.
+#
+# python loadtest.py Dashboard_LE4_fast.py --clients 50 --duration 60
+# python loadtest.py Dashboard_LE4_slow --clients 50 --duration 60 --csv slow.csv
+# python loadtest.py --url http://127.0.0.1:8050 --pid 1234 --clients 20
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+ACTIONS = {'scrub': 0.5, 'select': 0.35, 'page': 0.15}
+
+# the dashboard files have no __main__ that can run without the debug reloader
+SERVE = '''
+import logging, os, runpy, sys
+logging.getLogger('werkzeug').setLevel(logging.ERROR)
+sys.path.insert(0, os.path.dirname(sys.argv[1]))
+app = runpy.run_path(sys.argv[1], run_name='loadtest')['app']
+app.run(host='127.0.0.1', port=int(sys.argv[2]), debug=False, threaded=True)
+'''
+
+
+async def http(host, port, method, path, body=None):
+    """(status, body bytes) of one request, on its own connection."""
+    data = json.dumps(body).encode() if body is not None else b''
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write((f'{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n'
+                      f'Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n').encode() + data)
+        await writer.drain()
+        raw = await reader.read()
+    finally:
+        writer.close()
+    head, _, payload = raw.partition(b'\r\n\r\n')
+    if b'transfer-encoding: chunked' in head.lower():
+        payload = _dechunk(payload)
+    return int(head.split(b' ', 2)[1]), payload
+
+
+def _dechunk(payload):
+    body = b''
+    while payload:
+        size, _, payload = payload.partition(b'\r\n')
+        size = int(size.split(b';')[0], 16)
+        if size == 0:
+            break
+        body, payload = body + payload[:size], payload[size + 2:]
+    return body
+
+
+def rss_mb(pid):
+    """Resident memory of the process and its children (Linux /proc), None once it is gone."""
+    total, pids = 0, [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pids.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError, StopIteration):
+            if current == pid:
+                return None
+    return total / 1024
+
+
+def walk(node):
+    """Every component of a layout (JSON) tree."""
+    if isinstance(node, list):
+        for child in node:
+            yield from walk(child)
+    elif isinstance(node, dict) and 'props' in node:
+        yield node
+        yield from walk(node['props'].get('children'))
+
+
+def split_output(output):
+    # 'graph.figure' or '..a.children...b.options..' for several outputs
+    specs = output[2:-2].split('...') if output.startswith('..') else [output]
+    return [tuple(spec.rsplit('.', 1)) for spec in specs]
+
+
+class Callback:
+    def __init__(self, dependency):
+        self.output = dependency['output']
+        self.outputs = split_output(self.output)
+        self.inputs = [(i['id'], i['property']) for i in dependency['inputs']]
+        self.state = [(s['id'], s['property']) for s in dependency['state']]
+        self.initial = not dependency.get('prevent_initial_call')
+        self.multi = self.output.startswith('..')
+
+    def ids(self):
+        return {component for component, _ in self.outputs + self.inputs}
+
+    def body(self, props, changed):
+        outputs = [{'id': component, 'property': prop} for component, prop in self.outputs]
+        return {
+            'output': self.output,
+            'outputs': outputs if self.multi else outputs[0],
+            'inputs': [{'id': c, 'property': p, 'value': props.get((c, p))} for c, p in self.inputs],
+            'state': [{'id': c, 'property': p, 'value': props.get((c, p))} for c, p in self.state],
+            'changedPropIds': [f'{c}.{p}' for c, p in self.inputs if (c, p) in changed],
+        }
+
+
+class Client:
+    """One simulated browser session."""
+
+    def __init__(self, host, port, records, rng, think):
+        self.host, self.port = host, port
+        self.records = records
+        self.rng = rng
+        self.think = think
+        self.props = {}
+        self.types = {}
+        self.base_ids = set()
+        self.mounted = {}
+
+    async def call(self, name, method, path, body=None):
+        start = time.perf_counter()
+        try:
+            status, payload = await http(self.host, self.port, method, path, body)
+        except OSError as error:
+            status, payload = type(error).__name__, b''
+        self.records.append((name, start, time.perf_counter() - start, status, len(payload)))
+        return status, payload
+
+    def present(self):
+        ids = set(self.base_ids)
+        for children in self.mounted.values():
+            ids |= children
+        return ids
+
+    def mount(self, tree, container=None):
+        """Take the props of newly rendered components, returns their ids."""
+        ids = set()
+        for node in walk(tree):
+            component = node['props'].get('id')
+            if component is None or not isinstance(component, str):
+                continue
+            ids.add(component)
+            self.types[component] = node['type']
+            for prop, value in node['props'].items():
+                if prop != 'children':
+                    self.props[(component, prop)] = value
+            if node['type'] == 'Location':
+                self.props.setdefault((component, 'pathname'), '/')
+        if container is None:
+            self.base_ids = ids
+        else:
+            self.mounted[container] = ids
+        return ids
+
+    async def load(self):
+        _, layout = await self.call('_dash-layout', 'GET', '/_dash-layout')
+        _, dependencies = await self.call('_dash-dependencies', 'GET', '/_dash-dependencies')
+        self.callbacks = [Callback(d) for d in json.loads(dependencies)
+                          if not d.get('clientside_function') and not d['output'].startswith('{')]
+        layout = json.loads(layout)
+        self.pages = sorted({node['props']['href'] for node in walk(layout) if node['type'] == 'Link'}) or ['/']
+        await self.fire(set(), self.mount(layout))
+
+    async def run_one(self, callback, changed):
+        status, payload = await self.call(callback.output, 'POST', '/_dash-update-component', callback.body(self.props, changed))
+        if status != 200:
+            return set(), set()
+        changes, new_ids = set(), set()
+        for component, values in json.loads(payload).get('response', {}).items():
+            for prop, value in values.items():
+                if isinstance(value, dict) and '__dash_patch_update' in value:
+                    changes.add((component, prop))  # a figure patch, the figure itself is not kept
+                    continue
+                self.props[(component, prop)] = value
+                changes.add((component, prop))
+                if prop == 'children':
+                    new_ids |= self.mount(value, container=component)
+        return changes, new_ids
+
+    async def fire(self, changed, new_ids=frozenset(), rounds=5):
+        """Run the callbacks for changed props / new components, then for what their responses changed."""
+        for _ in range(rounds):
+            present = self.present()
+            due = [cb for cb in self.callbacks
+                   if all(component in present for component, _ in cb.outputs + cb.inputs)
+                   and (any(i in changed for i in cb.inputs) or (cb.initial and cb.ids() & new_ids))]
+            if not due:
+                return
+            results = await asyncio.gather(*(self.run_one(cb, changed) for cb in due))
+            changed = set().union(*(changes for changes, _ in results))
+            new_ids = set().union(*(ids for _, ids in results))
+
+    def components(self, kind):
+        return [c for c in self.present() if self.types.get(c) == kind]
+
+    async def scrub(self):
+        sliders = self.components('Slider')
+        if not sliders:
+            return
+        slider = self.rng.choice(sliders)
+        marks = sorted(float(mark) for mark in self.props.get((slider, 'marks')) or {})
+        if not marks:
+            return
+        value = self.props.get((slider, 'value'))
+        position = int(np.searchsorted(marks, value if value is not None else marks[-1]))
+        direction = self.rng.choice([-1, 1])
+        for _ in range(self.rng.randint(2, 5)):
+            position = min(max(position + direction, 0), len(marks) - 1)
+            mark = marks[position]
+            self.props[(slider, 'value')] = int(mark) if mark.is_integer() else mark
+            await self.fire({(slider, 'value')})
+            await asyncio.sleep(self.rng.expovariate(1 / (self.think / 4)))
+
+    async def select(self):
+        dropdowns = [d for d in self.components('Dropdown') if self.props.get((d, 'options'))]
+        if not dropdowns:
+            return
+        dropdown = self.rng.choice(dropdowns)
+        values = [o['value'] if isinstance(o, dict) else o for o in self.props[(dropdown, 'options')]]
+        if self.props.get((dropdown, 'multi')):
+            value = self.rng.sample(values, self.rng.randint(1, min(3, len(values))))
+        else:
+            value = self.rng.choice(values)
+        self.props[(dropdown, 'value')] = value
+        await self.fire({(dropdown, 'value')})
+
+    async def page(self):
+        locations = self.components('Location')
+        if not locations or len(self.pages) < 2:
+            return
+        current = self.props.get((locations[0], 'pathname'))
+        self.props[(locations[0], 'pathname')] = self.rng.choice([p for p in self.pages if p != current])
+        await self.fire({(locations[0], 'pathname')})
+
+    async def run(self, deadline):
+        await self.load()
+        actions, weights = list(ACTIONS), list(ACTIONS.values())
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(self.rng.expovariate(1 / self.think))
+            await getattr(self, self.rng.choices(actions, weights)[0])()
+
+
+async def sample_memory(pid, samples, stop, interval=0.5):
+    while not stop.is_set():
+        rss = rss_mb(pid)
+        if rss is not None:
+            samples.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def load_test(host, port, pid, clients, duration, ramp, think, seed):
+    records, memory = [], []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_memory(pid, memory, stop)) if pid else None
+    start = time.perf_counter()
+    deadline = start + duration
+
+    async def client(i):
+        await asyncio.sleep(ramp * i / max(clients, 1))
+        await Client(host, port, records, random.Random(seed + i), think).run(deadline)
+
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    if sampler:
+        await sampler
+    return records, memory, elapsed
+
+
+def report(records, elapsed):
+    df = pd.DataFrame(records, columns=['callback', 'start', 'latency', 'status', 'bytes'])
+    df['error'] = ~df['status'].isin([200, 204])
+    rows = []
+    for name, group in list(df.groupby('callback')) + [('total', df)]:
+        latency = group['latency'].to_numpy() * 1000
+        rows.append({'callback': name, 'requests': len(group), 'errors': int(group['error'].sum()),
+                     'rps': len(group) / elapsed, 'p50_ms': np.percentile(latency, 50),
+                     'p95_ms': np.percentile(latency, 95), 'p99_ms': np.percentile(latency, 99),
+                     'max_ms': latency.max(), 'mean_bytes': group['bytes'].mean()})
+    return pd.DataFrame(rows)
+
+
+def wait_until_up(host, port, process, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'the dashboard exited with code {process.returncode}')
+        try:
+            status, _ = asyncio.run(http(host, port, 'GET', '/_dash-layout'))
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError('the dashboard did not come up')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated concurrent users against the callbacks of a dashboard')
+    parser.add_argument('dashboard', nargs='?', help='dashboard file to start, e.g. Dashboard_LE4_fast.py')
+    parser.add_argument('--url', help='target a running server instead of starting one')
+    parser.add_argument('--pid', type=int, help='server process for the memory numbers with --url')
+    parser.add_argument('--port', type=int, default=8060, help='port of the started dashboard')
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load')
+    parser.add_argument('--ramp', type=float, default=5, help='seconds over which the clients start')
+    parser.add_argument('--think', type=float, default=1.0, help='mean seconds between the actions of a client')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--csv', help='also write the results to this csv file')
+    args = parser.parse_args()
+    if not args.dashboard and not args.url:
+        parser.error('give a dashboard file or --url')
+
+    process = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port, pid = url.hostname, url.port or 80, args.pid
+    else:
+        host, port = '127.0.0.1', args.port
+        process = subprocess.Popen([sys.executable, '-c', SERVE, os.path.abspath(args.dashboard), str(port)],
+                                   stdout=subprocess.DEVNULL)
+        pid = process.pid
+    try:
+        if process:
+            wait_until_up(host, port, process)
+        records, memory, elapsed = asyncio.run(
+            load_test(host, port, pid, args.clients, args.duration, args.ramp, args.think, args.seed))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    results = report(records, elapsed)
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(results.to_string(index=False, float_format=lambda v: f'{v:.1f}'))
+    if memory:
+        print(f'\nserver memory: start {memory[0]:.1f} MB, peak {max(memory):.1f} MB, '
+              f'end {memory[-1]:.1f} MB, growth {memory[-1] - memory[0]:+.1f} MB')
+    if args.csv:
+        results.to_csv(args.csv, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+# Choropleth maps as one base figure plus small per-call patches
+#
+# px.choropleth resends every location, the hover template, the color axis and the whole
+# layout on every slider move, while only the values change with the year. The base figure
+# here has one trace over every location in the data and is built once (it goes out with
+# the page layout); the callbacks return a dash.Patch that only replaces z / hovertext /
+# customdata:
+#
+#   world = ChoroplethMap(df_gdp, 'alpha-3', 'gdpPercapita', hover_name='country',
+#                         hover_data={'population': None, 'lifeExpectancy': ':.1f'})
+#   dcc.Graph(id='map-graph', figure=world.base(width=1000, height=1000))
+#   return world.patch(gdp_index.select(year))
+#
+# Geometry (MAP_GEOMETRY or geometry=...):
+#   110m   the builtin plotly.js world map at 1:110m, plotly's default resolution (what
+#          px.choropleth uses anyway, so no saving over the full mode)
+#   50m    the builtin map at 1:50m
+#   path   a GeoJSON file (.geojson / .json) of the countries, sent with the base figure only.
+#          simplify_geojson thins every ring once with Douglas-Peucker (points closer than
+#          `tolerance` degrees to the simplified line are dropped) and rounds the coordinates
+#          to `decimals`; rings that shrink below a triangle (small islands, lakes) are dropped
+#
+# DASH_MAP_MODE=full switches the dashboards back to a complete px.choropleth per call.
+# python bench_map.py compares the bytes sent per interaction of both modes, and with --geojson
+# the size of the base figure per simplification tolerance.
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.express as px
+import plotly.graph_objects as go
+from dash import Patch
+
+GEOMETRY = os.environ.get('MAP_GEOMETRY', '110m')
+
+# plotly.js default outline of the shapes
+DEFAULT_LINE = {'width': 1, 'color': '#444'}
+
+
+def patch_enabled():
+    return os.environ.get('DASH_MAP_MODE', 'patch') != 'full'
+
+
+def payload_bytes(value):
+    """Size of a callback output (figure, dict or Patch) as it goes over the wire."""
+    if isinstance(value, Patch):
+        value = value.to_plotly_json()
+    return len(json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder).encode())
+
+
+def _douglas_peucker(points, tolerance):
+    # mask of the points kept: split each span at the point furthest from its chord while that
+    # is more than `tolerance` away (a closed ring's chord is a point, the distance is to it)
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    spans = [(0, len(points) - 1)]
+    while spans:
+        start, end = spans.pop()
+        if end - start < 2:
+            continue
+        chord = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(*chord)
+        if length:
+            distances = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / length
+        else:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        furthest = int(np.argmax(distances))
+        if distances[furthest] > tolerance:
+            split = start + 1 + furthest
+            keep[split] = True
+            spans += [(start, split), (split, end)]
+    return keep
+
+
+def _simplify_ring(ring, tolerance, decimals):
+    points = np.asarray(ring, dtype=float)[:, :2]
+    if tolerance and len(points) > 4:
+        points = points[_douglas_peucker(points, tolerance)]
+    # round the coordinates and drop the points that collapse onto their predecessor
+    points = np.round(points, decimals)
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+    points = points[keep]
+    return points.tolist() if len(points) >= 4 else None
+
+
+def simplify_geojson(geojson, tolerance=0.05, decimals=2):
+    """Countries with every ring simplified to `tolerance` degrees and coordinates rounded to `decimals`.
+
+    Rings that degenerate are dropped, a polygon with them when it is its outer ring.
+    """
+    features = []
+    for feature in geojson['features']:
+        geometry = feature['geometry']
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        simplified = []
+        for polygon in polygons:
+            rings = [_simplify_ring(ring, tolerance, decimals) for ring in polygon]
+            if rings and rings[0] is not None:
+                simplified.append([ring for ring in rings if ring is not None])
+        if simplified:
+            features.append({**feature, 'geometry': {'type': 'MultiPolygon', 'coordinates': simplified}})
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def load_geometry(geometry=GEOMETRY, tolerance=0.05, decimals=2):
+    """geo layout / trace settings for '110m', '50m' or a GeoJSON path."""
+    if geometry in ('110m', '50m'):
+        return {'resolution': int(geometry[:-1])}, {'locationmode': 'ISO-3'}
+    with open(geometry) as f:
+        geojson = simplify_geojson(json.load(f), tolerance, decimals)
+    return {'fitbounds': 'locations', 'visible': False}, {'geojson': geojson, 'featureidkey': 'properties.ISO_A3'}
+
+
+class ChoroplethMap:
+    def __init__(self, df, location, color, hover_name=None, hover_data=None, geometry=GEOMETRY,
+                 color_continuous_scale=px.colors.sequential.Plasma, tolerance=0.05, decimals=2):
+        """hover_data: {column: format, None to show it as is or False to hide it}, like px hover_data.
+
+        The location and color columns are always in the tooltip unless hidden with False.
+        """
+        self.location = location
+        self.color = color
+        self.hover_name = hover_name
+        self.hover_data = dict(hover_data or {})
+        self.geometry = geometry
+        self.tolerance = tolerance
+        self.decimals = decimals
+        self.colorscale = color_continuous_scale
+        self.locations = pd.Index(df[location].dropna().unique())
+
+    def _positions(self, rows):
+        return self.locations.get_indexer(rows[self.location])
+
+    def _column(self, rows, column, positions):
+        # one value per base location, None where the selection has no row
+        values = np.full(len(self.locations), None, dtype=object)
+        values[positions] = rows[column].to_numpy(dtype=object)
+        return values.tolist()
+
+    def _custom_columns(self):
+        # the tooltip columns that are not already in the trace as locations / z
+        return [column for column, fmt in self.hover_data.items()
+                if fmt is not False and column not in (self.location, self.color)]
+
+    def arrays(self, rows):
+        """The data arrays of the trace for the selected rows."""
+        rows = rows[rows[self.location].isin(self.locations)]
+        positions = self._positions(rows)
+        arrays = {'z': self._column(rows, self.color, positions)}
+        if self.hover_name:
+            arrays['hovertext'] = self._column(rows, self.hover_name, positions)
+        if self._custom_columns():
+            columns = [self._column(rows, column, positions) for column in self._custom_columns()]
+            arrays['customdata'] = [list(values) for values in zip(*columns)]
+        return arrays
+
+    def hovertemplate(self):
+        hover_data = {self.location: None, self.color: None, **self.hover_data}
+        custom = self._custom_columns()
+        lines = []
+        for column, fmt in hover_data.items():
+            if fmt is False:
+                continue
+            if column == self.location:
+                value = 'location'
+            elif column == self.color:
+                value = 'z'
+            else:
+                value = f'customdata[{custom.index(column)}]'
+            lines.append(f'{column}=%{{{value}{fmt or ""}}}')
+        title = '<b>%{hovertext}</b><br><br>' if self.hover_name else ''
+        return title + '<br>'.join(lines) + '<extra></extra>'
+
+    def base(self, rows=None, **layout):
+        """The figure every patch applies to, optionally already showing `rows`."""
+        geo, trace = load_geometry(self.geometry, self.tolerance, self.decimals)
+        arrays = self.arrays(rows) if rows is not None else {'z': [None] * len(self.locations)}
+        fig = go.Figure(go.Choropleth(locations=list(self.locations), coloraxis='coloraxis', name='',
+                                      hovertemplate=self.hovertemplate(), **trace, **arrays))
+        fig.update_layout(
+            geo={'domain': {'x': [0.0, 1.0], 'y': [0.0, 1.0]}, **geo},
+            coloraxis={'colorscale': self.colorscale, 'colorbar': {'title': {'text': self.color}}},
+            legend={'tracegroupgap': 0},
+        )
+        fig.update_layout(**layout)
+        return fig
+
+    def patch(self, rows, marker_line=None):
+        """dash.Patch with the values of `rows`, and the outline of the shapes if given (e.g. DEFAULT_LINE)."""
+        patch = Patch()
+        for key, values in self.arrays(rows).items():
+            patch['data'][0][key] = values
+        if marker_line is not None:
+            patch['data'][0]['marker']['line'] = marker_line
+        return patch
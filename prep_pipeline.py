@@ -0,0 +1,348 @@
+# The steps of data_prep.ipynb as an incremental stage DAG
+#
+#   flights_clean/<year>  -> flights_datetimes/<year> -> flights_dep/<year>, flights_arr/<year>, rollups/<year>
+#   airports              ----------------------------^
+#   flights_datetimes/<year> -> pyramids/<year>
+#   gapminder_clean, iso_codes, lat_long -> gapminder_join_slow -> gapminder_join
+#   gapminder_clean -> gapminder
+#
+# Every stage output is cached under a key that hashes the stage code (plus the helper
+# modules it lists and the module level constants it uses, e.g. DEP_COLUMNS), the content of its input files and the keys of its upstream stages.
+# A run only recomputes stages whose key changed: a new Data/<year>.csv computes that year's
+# partitions, editing the gapminder cleaning recomputes the gapminder stages only. Stages with
+# a `table` write straight into the store (store/flight_data_arr/<year>/, store/data_gapminder/,
+# ...), the others are cached in store/cache/. The keys are kept in store/_pipeline.json.
+#
+# python prep_pipeline.py run                  # everything that is out of date
+# python prep_pipeline.py run gapminder_join   # one stage and what it needs
+# python prep_pipeline.py run --years 2018 --force
+# python prep_pipeline.py status
+import argparse
+import glob
+import hashlib
+import inspect
+import json
+import os
+import time
+
+import pandas as pd
+
+import airport_dim
+import data_schema
+import flight_ingest
+import flight_prep
+import flight_rollup
+import time_pyramid
+from airport_dim import add_keys, build_dimension
+from data_schema import DERIVED_TIME_COLUMNS, FLIGHT_SCHEMA, apply_schema
+from data_store import STORE_ROOT, read_table, table_path, write_partition, write_table
+from flight_ingest import ARR_COLUMNS, DEP_COLUMNS, read_airports, read_flight_chunks
+from flight_prep import build_datetimes
+from flight_rollup import write_rollups
+from time_pyramid import write_pyramid
+
+MANIFEST_FILE = '_pipeline.json'
+CACHE_DIR = 'cache'
+
+STAGES = {}
+
+
+class Stage:
+    def __init__(self, name, func, inputs=(), files=(), table=None, partitioned=False, modules=(), output=True):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.files = files
+        self.table = table
+        self.partitioned = partitioned
+        self.modules = list(modules)
+        self.output = output
+
+    def input_files(self, data_dir, year=None):
+        files = self.files(year) if callable(self.files) else self.files
+        return [os.path.join(data_dir, path) for path in files]
+
+    def code(self):
+        source = ''.join(inspect.getsource(obj) for obj in [self.func] + self.modules)
+        return source + ''.join(f'{name}={value!r}' for name, value in self.constants())
+
+    def constants(self):
+        # module level values the stage reads (column lists, schemas), whose definition is
+        # not in the stage source; functions and modules are covered by the source / modules
+        names, codes = set(), [self.func.__code__]
+        while codes:
+            code = codes.pop()
+            names.update(code.co_names)
+            codes.extend(const for const in code.co_consts if inspect.iscode(const))
+        return [(name, self.func.__globals__[name]) for name in sorted(names)
+                if name in self.func.__globals__ and not callable(self.func.__globals__[name])
+                and not inspect.ismodule(self.func.__globals__[name])]
+
+
+def stage(inputs=(), files=(), table=None, partitioned=False, modules=(), output=True):
+    """Register a prep stage.
+
+    The function gets the outputs of `inputs` in order, plus data_dir / root / year if it
+    has parameters of that name. Partitioned stages run once per year. output=False marks
+    stages that write their results themselves.
+    """
+    def register(func):
+        STAGES[func.__name__] = Stage(func.__name__, func, inputs, files, table, partitioned, modules, output)
+        return func
+    return register
+
+
+# Flights, one partition per Data/<year>.csv
+
+@stage(files=lambda year: [f'{year}.csv'], partitioned=True, modules=[flight_ingest])
+def flights_clean(data_dir, year):
+    # only the needed columns with pinned dtypes, rows without times dropped
+    chunks = list(read_flight_chunks(os.path.join(data_dir, f'{year}.csv'), datetimes=False))
+    return pd.concat(chunks, ignore_index=True)
+
+
+@stage(inputs=['flights_clean'], partitioned=True, modules=[flight_prep])
+def flights_datetimes(flights):
+    return build_datetimes(flights)
+
+
+@stage(files=[os.path.join('Airports', 'airports.csv')], table=airport_dim.DIMENSION, modules=[airport_dim])
+def airports(data_dir):
+    # airports without url, county, icao, city_code, time_zone_id, name, elevation, keyed by code
+    return build_dimension(read_airports(data_dir))
+
+
+@stage(inputs=['flights_datetimes', 'airports'], table='flight_data_dep', partitioned=True, modules=[airport_dim, data_schema])
+def flights_dep(flights, airports):
+    return apply_schema(add_keys(flights[DEP_COLUMNS], 'ORIGIN', airports), drop=DERIVED_TIME_COLUMNS, schema=FLIGHT_SCHEMA)[0]
+
+
+@stage(inputs=['flights_datetimes', 'airports'], table='flight_data_arr', partitioned=True, modules=[airport_dim, data_schema])
+def flights_arr(flights, airports):
+    return apply_schema(add_keys(flights[ARR_COLUMNS], 'DEST', airports), drop=DERIVED_TIME_COLUMNS, schema=FLIGHT_SCHEMA)[0]
+
+
+@stage(inputs=['flights_datetimes', 'airports'], partitioned=True, modules=[flight_rollup], output=False)
+def rollups(flights, airports, year, root):
+    # store/rollup_*/<year>/
+    write_rollups(year, {'arr': flights[ARR_COLUMNS], 'dep': flights[DEP_COLUMNS]}, airports, root=root)
+
+
+@stage(inputs=['flights_datetimes'], partitioned=True, modules=[time_pyramid], output=False)
+def pyramids(flights, year, root):
+    # store/pyramid_*/<year>/, day / hour / 5min delay buckets for the zoomable delay view
+    write_pyramid(year, {'arr': flights[ARR_COLUMNS], 'dep': flights[DEP_COLUMNS]}, root=root)
+
+
+# Gapminder
+
+@stage(files=['data.csv'])
+def gapminder_clean(data_dir):
+    data_gapminder = pd.read_csv(os.path.join(data_dir, 'data.csv'))
+    data_gapminder = data_gapminder.drop(columns=['drop'])
+    data_gapminder.year = data_gapminder.year.astype(str)
+
+    # drop all rows in lifeExp == Africa or Asia (shifted rows), then lifeExp is numeric
+    data_gapminder = data_gapminder[~data_gapminder.lifeExp.isin(['Africa', 'Asia'])].copy()
+    data_gapminder.lifeExp = data_gapminder.lifeExp.astype(float)
+    data_gapminder = data_gapminder.dropna()
+
+    # round lifeExp and pop to 2 decimal places, year and gdpPercap as int
+    data_gapminder.lifeExp = data_gapminder.lifeExp.round(2)
+    data_gapminder['pop'] = data_gapminder['pop'].round(2)
+    data_gapminder.year = data_gapminder.year.astype(int)
+    data_gapminder.gdpPercap = data_gapminder.gdpPercap.astype(int)
+    return data_gapminder
+
+
+@stage(files=['iso_code.csv'])
+def iso_codes(data_dir):
+    iso_country = pd.read_csv(os.path.join(data_dir, 'iso_code.csv'))
+    iso_country = iso_country.drop(['alpha-2', 'country-code', 'iso_3166-2', 'region', 'sub-region', 'intermediate-region',
+                                    'region-code', 'sub-region-code', 'intermediate-region-code'], axis=1)
+    iso_country.loc[iso_country.name == 'United States of America', 'name'] = 'United States'
+    return iso_country
+
+
+@stage(files=['world_country_and_usa_states_latitude_and_longitude_values.csv'])
+def lat_long(data_dir):
+    lat_long_data = pd.read_csv(os.path.join(data_dir, 'world_country_and_usa_states_latitude_and_longitude_values.csv'))
+    return lat_long_data.drop(['usa_state', 'usa_state_code', 'usa_state_latitude', 'usa_state_longitude', 'country_code'], axis=1)
+
+
+@stage(inputs=['gapminder_clean'], table='data_gapminder', modules=[data_schema])
+def gapminder(data_gapminder):
+    return apply_schema(data_gapminder)[0]
+
+
+@stage(inputs=['gapminder_clean', 'iso_codes', 'lat_long'], table='data_gapminder_join_slow', modules=[data_schema])
+def gapminder_join_slow(data_gapminder, iso_country, lat_long_data):
+    data_gapminder_join = data_gapminder.merge(iso_country, left_on='country', right_on='name', how='inner')
+    data_gapminder_join = data_gapminder_join.merge(lat_long_data, left_on='country', right_on='country', how='inner')
+    return apply_schema(data_gapminder_join)[0]
+
+
+@stage(inputs=['gapminder_join_slow'], table='data_gapminder_join', modules=[data_schema])
+def gapminder_join(data_gapminder_join):
+    data_gapminder_join = data_gapminder_join.rename(columns={"pop": "population", "lifeExp": "lifeExpectancy", "gdpPercap": "gdpPercapita"})
+    return apply_schema(data_gapminder_join.drop(['name'], axis=1))[0]
+
+
+def file_hash(path, memo):
+    # content hash, remembered by size + mtime so unchanged csv files are not read again
+    stat = os.stat(path)
+    entry = memo.get(path)
+    if entry and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return entry[2]
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    memo[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+    return memo[path][2]
+
+
+class Pipeline:
+    def __init__(self, data_dir='Data', root=STORE_ROOT, years=None):
+        self.data_dir = data_dir
+        self.root = root
+        self._years = years
+        self.manifest_path = os.path.join(root, MANIFEST_FILE)
+        try:
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {'stages': {}, 'files': {}}
+        self._keys = {}
+        self._values = {}
+
+    def years(self):
+        """The yearly flight csv files in data_dir (or the years given)."""
+        if self._years is not None:
+            return list(self._years)
+        names = (os.path.splitext(os.path.basename(path))[0] for path in glob.glob(os.path.join(self.data_dir, '*.csv')))
+        return sorted(int(name) for name in names if name.isdigit())
+
+    def partitions(self, name):
+        return self.years() if STAGES[name].partitioned else [None]
+
+    def _id(self, name, year):
+        return name if year is None else f'{name}/{year}'
+
+    def _upstream(self, name, year):
+        return [(upstream, year if STAGES[upstream].partitioned else None) for upstream in STAGES[name].inputs]
+
+    def key(self, name, year=None):
+        """Hash of the stage code, its input files and the keys of its inputs."""
+        stage_id = self._id(name, year)
+        if stage_id not in self._keys:
+            definition = STAGES[name]
+            digest = hashlib.sha1(stage_id.encode())
+            digest.update(definition.code().encode())
+            for path in definition.input_files(self.data_dir, year):
+                digest.update(file_hash(path, self.manifest['files']).encode())
+            for upstream in self._upstream(name, year):
+                digest.update(self.key(*upstream).encode())
+            self._keys[stage_id] = digest.hexdigest()
+        return self._keys[stage_id]
+
+    def _location(self, name):
+        definition = STAGES[name]
+        if definition.table:
+            return definition.table, self.root
+        return name, os.path.join(self.root, CACHE_DIR)
+
+    def _exists(self, name, year):
+        table, root = self._location(name)
+        folder = table_path(table, root) if year is None else os.path.join(table_path(table, root), str(year))
+        return os.path.exists(folder)
+
+    def is_current(self, name, year=None):
+        if self.manifest['stages'].get(self._id(name, year)) != self.key(name, year):
+            return False
+        # stages that write their own results have no output to check
+        return not STAGES[name].output or self._exists(name, year)
+
+    def _load(self, name, year):
+        table, root = self._location(name)
+        return read_table(table, partitions=None if year is None else [year], root=root, mmap=False)
+
+    def _save(self, name, year, value):
+        table, root = self._location(name)
+        if year is None:
+            write_table(value, table, root=root)
+        else:
+            write_partition(value, table, year, root=root)
+
+    def _write_manifest(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+    def value(self, name, year=None, force=False, log=None):
+        """Output of a stage, from the cache if its key did not change, computed otherwise."""
+        stage_id = self._id(name, year)
+        if stage_id in self._values:
+            return self._values[stage_id]
+        if not force and self.is_current(name, year):
+            value = self._load(name, year) if STAGES[name].output else None
+            status = 'cached'
+        else:
+            start = time.perf_counter()
+            inputs = [self.value(upstream, upstream_year, log=log) for upstream, upstream_year in self._upstream(name, year)]
+            context = {'data_dir': self.data_dir, 'root': self.root, 'year': year}
+            parameters = inspect.signature(STAGES[name].func).parameters
+            value = STAGES[name].func(*inputs, **{key: context[key] for key in context if key in parameters})
+            if value is not None:
+                self._save(name, year, value.reset_index(drop=True))
+            self.manifest['stages'][stage_id] = self.key(name, year)
+            self._write_manifest()
+            status = f'computed in {time.perf_counter() - start:.1f}s'
+        self._values[stage_id] = value
+        if log:
+            log(stage_id, status)
+        return value
+
+    def run(self, targets=None, force=False, log=None):
+        """Bring the targets (default: every stage without downstream stages) up to date."""
+        targets = targets or [name for name in STAGES if not any(name in s.inputs for s in STAGES.values())]
+        for name in targets:
+            for year in self.partitions(name):
+                if force or not self.is_current(name, year):
+                    self.value(name, year, force=force, log=log)
+                elif log:
+                    log(self._id(name, year), 'up to date')
+                # only one partition in memory at a time
+                self._values.clear()
+
+    def status(self):
+        """(stage id, up to date) of every stage and partition."""
+        return [(self._id(name, year), self.is_current(name, year)) for name in STAGES for year in self.partitions(name)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Incremental data prep pipeline (the steps of data_prep.ipynb)')
+    parser.add_argument('command', choices=['run', 'status'])
+    parser.add_argument('stages', nargs='*', help=f"stages to bring up to date, default all ({', '.join(STAGES)})")
+    parser.add_argument('--years', nargs='+', type=int, help='flight years, default every Data/<year>.csv')
+    parser.add_argument('--force', action='store_true', help='recompute the given stages even if cached')
+    parser.add_argument('--data-dir', default='Data')
+    parser.add_argument('--root', default=STORE_ROOT)
+    args = parser.parse_args()
+
+    unknown = [name for name in args.stages if name not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+
+    pipeline = Pipeline(args.data_dir, args.root, args.years)
+    if args.command == 'status':
+        for stage_id, current in pipeline.status():
+            print(f"{stage_id:30} {'up to date' if current else 'out of date'}")
+    else:
+        pipeline.run(args.stages, args.force, log=lambda stage_id, status: print(f"{stage_id:30} {status}"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+# Headless rendering benchmark, generalizes the test scenarios of LE1_performance.ipynb
+#
+# Runs every combination of data subset (smallest-N destinations), point count, chart type
+# and render mode and measures figure construction time, JSON serialization time, HTML size
+# (without plotly.js) and peak Python memory. No browser is needed.
+#
+# python render_bench.py --out results.csv
+# python render_bench.py --subsets 200 300 all --points 10000 100000 all --repeat 5 --out results.json
+# python render_bench.py --synthetic 500000 --out new.csv --compare baseline.csv --tolerance 1.25
+#
+# With --compare the run fails (exit code 1) if a time or size is worse than the baseline
+# by more than the tolerance factor, so it can guard changes before they ship.
+import argparse
+import itertools
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.express as px
+
+CHARTS = {'line': px.line, 'scatter': px.scatter}
+RENDER_MODES = ('svg', 'webgl')
+METRICS = ('build_s', 'serialize_s', 'html_bytes', 'peak_mem_bytes')
+
+
+def load_arrivals(synthetic=None, seed=0):
+    """ARR_DATETIME, ARR_DELAY, DEST from the store, or `synthetic` generated flights."""
+    if synthetic:
+        rng = np.random.default_rng(seed)
+        dest = np.array([f'A{i:03d}' for i in range(350)])
+        weights = rng.pareto(1.2, len(dest)) + 1
+        return pd.DataFrame({
+            'ARR_DATETIME': np.datetime64('2018-01-01') + rng.integers(0, 365 * 24 * 60, synthetic).astype('timedelta64[m]'),
+            'ARR_DELAY': rng.gumbel(0, 25, synthetic).round(),
+            'DEST': rng.choice(dest, synthetic, p=weights / weights.sum()),
+        })
+    from data_store import read_table
+    return read_table('flight_data_arr', columns=['ARR_DATETIME', 'ARR_DELAY', 'DEST'], mmap=False)
+
+
+def scenario_series(flight_data_arr, n_dest=None):
+    """Sorted x / y of the n_dest destinations with the fewest flights (all destinations for None)."""
+    subset = flight_data_arr
+    if n_dest is not None:
+        counts = flight_data_arr.groupby('DEST', observed=True)['DEST'].count().sort_values(ascending=True)
+        subset = flight_data_arr[flight_data_arr['DEST'].isin(counts.head(n_dest).index)]
+    subset = subset.dropna(subset=['ARR_DELAY']).sort_values('ARR_DATETIME')
+    return subset['ARR_DATETIME'].values, subset['ARR_DELAY'].values
+
+
+def take_points(x, y, n_points=None):
+    # evenly spaced sample, keeps the whole time range of the subset
+    if n_points is None or n_points >= len(x):
+        return x, y
+    keep = np.linspace(0, len(x) - 1, n_points).astype(np.int64)
+    return x[keep], y[keep]
+
+
+def render_once(x, y, chart, render_mode):
+    start = time.perf_counter()
+    fig = CHARTS[chart](x=x, y=y, render_mode=render_mode)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fig.to_json()
+    serialize = time.perf_counter() - start
+
+    html_bytes = len(fig.to_html(include_plotlyjs=False, full_html=True).encode())
+    return build, serialize, html_bytes
+
+
+def peak_memory(x, y, chart, render_mode):
+    # separate run, tracemalloc slows everything down and would distort the timings
+    tracemalloc.start()
+    try:
+        CHARTS[chart](x=x, y=y, render_mode=render_mode).to_json()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(flight_data_arr, subsets, points, charts, render_modes, repeat=3):
+    """Benchmark every combination, returns one row per combination (best of `repeat` timings)."""
+    rows = []
+    # the first figure pays for plotly's lazy imports and validators, keep it out of the numbers
+    render_once(np.arange(10), np.arange(10), 'line', 'svg')
+    for n_dest in subsets:
+        x_all, y_all = scenario_series(flight_data_arr, n_dest)
+        for n_points, chart, render_mode in itertools.product(points, charts, render_modes):
+            x, y = take_points(x_all, y_all, n_points)
+            timings = [render_once(x, y, chart, render_mode) for _ in range(repeat)]
+            rows.append({
+                'subset': 'all' if n_dest is None else n_dest,
+                'points': len(x),
+                'chart': chart,
+                'render_mode': render_mode,
+                'build_s': min(t[0] for t in timings),
+                'serialize_s': min(t[1] for t in timings),
+                'html_bytes': timings[0][2],
+                'peak_mem_bytes': peak_memory(x, y, chart, render_mode),
+            })
+    results = pd.DataFrame(rows)
+    results['python'] = platform.python_version()
+    results['plotly'] = plotly.__version__
+    return results
+
+
+def write_results(results, path):
+    if path.endswith('.json'):
+        results.to_json(path, orient='records', indent=1)
+    else:
+        results.to_csv(path, index=False)
+
+
+def read_results(path):
+    return pd.read_json(path, orient='records') if path.endswith('.json') else pd.read_csv(path)
+
+
+def compare(results, baseline, tolerance):
+    """Rows where a metric got worse than the baseline by more than `tolerance` (factor)."""
+    keys = ['subset', 'points', 'chart', 'render_mode']
+    results = results.astype({'subset': str})
+    baseline = baseline.astype({'subset': str})
+    merged = results.merge(baseline, on=keys, suffixes=('', '_baseline'))
+    regressions = []
+    for metric in METRICS:
+        worse = merged[merged[metric] > merged[f'{metric}_baseline'] * tolerance]
+        for _, row in worse.iterrows():
+            regressions.append({**{k: row[k] for k in keys}, 'metric': metric,
+                                'baseline': row[f'{metric}_baseline'], 'value': row[metric]})
+    return pd.DataFrame(regressions)
+
+
+def parse_optional_ints(values):
+    # 'all' means no limit (all destinations / all points)
+    return [None if v == 'all' else int(v) for v in values]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless Plotly rendering benchmark for the flight test scenarios')
+    parser.add_argument('--subsets', nargs='+', default=['200', '250', '300'], help="smallest-N destinations or 'all'")
+    parser.add_argument('--points', nargs='+', default=['1000', '10000', '100000', 'all'], help="point counts or 'all'")
+    parser.add_argument('--charts', nargs='+', default=list(CHARTS), choices=list(CHARTS))
+    parser.add_argument('--render-modes', nargs='+', default=list(RENDER_MODES), choices=RENDER_MODES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--synthetic', type=int, help='use n synthetic flights instead of the store')
+    parser.add_argument('--out', default='render_bench.csv', help='.csv or .json')
+    parser.add_argument('--compare', help='baseline results (.csv or .json) to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    args = parser.parse_args()
+
+    flight_data_arr = load_arrivals(args.synthetic)
+    results = run(flight_data_arr, parse_optional_ints(args.subsets), parse_optional_ints(args.points),
+                  args.charts, args.render_modes, args.repeat)
+    write_results(results, args.out)
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(results.drop(columns=['python', 'plotly']).to_string(index=False, float_format=lambda v: f'{v:.4f}'))
+    print(f"results written to {os.path.abspath(args.out)}")
+
+    if args.compare:
+        regressions = compare(results, read_results(args.compare), args.tolerance)
+        if len(regressions):
+            print(f"\n{len(regressions)} regressions (> {args.tolerance}x baseline):")
+            print(regressions.to_string(index=False))
+            sys.exit(1)
+        print(f"\nno regressions against {args.compare}")
+
+
+if __name__ == '__main__':
+    main()
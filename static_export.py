@@ -0,0 +1,297 @@
+# Batch export of pre-rendered dashboard figures
+#
+# Renders the whole filter space of the dashboards through their own callbacks, in a
+# process pool (every worker loads a dashboard once):
+#
+#   Dashboard_LE4_fast / _slow   scatter + bar per year x continent, the full map per year
+#                                (DASH_MAP_MODE=full only: in the default patch mode the map page
+#                                carries the base figure and a year is a small Patch, nothing to export)
+#   Dashboard_le2 / _le3         scatter + bar per slider stop x continent (le3: not with
+#                                DASH_CLIENTSIDE=1, the browser draws the figures then)
+#   Dashboard_3_hicks            the scatter per year button and per continent button
+#   Dashboard_flight_delay       every destination scenario x reduction method, zoomed out
+#
+# into export/<dashboard>/<callback>/<args>.json (the callback output) and .html (a page
+# per figure). The HTML pages load one shared plotly-<version>.min.js from export/ instead
+# of embedding 3.5 MB of plotly.js each. export/manifest.json lists every figure by its
+# normalized callback arguments together with the data stamp it was rendered from, so a
+# dashboard started with STATIC_FIGURES_DIR=export serves those figures from disk:
+#
+#   static_figures = StaticFigures('Dashboard_LE4_fast')
+#
+#   @app.callback(...)
+#   @static_figures.prerendered
+#   @figure_cache.cached
+#   def update_scatter(selected_year, selected_continent, selected_country): ...
+#
+# Figures rendered from other data (a changed store table) are ignored, the callback runs.
+#
+# python static_export.py                                  # all dashboards
+# python static_export.py Dashboard_LE4_fast --workers 4 --no-html
+import argparse
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import runpy
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import plotly
+import plotly.io as pio
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+
+from data_store import table_hash
+from figure_cache import normalize
+
+logger = logging.getLogger('static_export')
+
+EXPORT_ROOT = 'export'
+MANIFEST_FILE = 'manifest.json'
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def le4_fast_jobs(ns):
+    years, continents = ns['gdp_index'].years(), ns['gdp_index'].continents()
+    jobs = [(callback, (year, continent, None)) for callback in ('update_scatter', 'update_bar')
+            for year in years for continent in continents]
+    if ns['MAP_PATCH']:
+        return jobs
+    return jobs + [('map_figure', ('/map', None, year, {})) for year in years]
+
+
+def le4_slow_jobs(ns):
+    years, continents = ns['gdp_index'].years(), ns['gdp_index'].continents()
+    jobs = [(callback, (year, continent)) for callback in ('update_scatter', 'update_bar')
+            for year in years for continent in continents]
+    if ns['MAP_PATCH']:
+        return jobs
+    return jobs + [('map_figure', ('/map', year, {})) for year in years]
+
+
+def le2_jobs(ns):
+    # the dropdown sends one continent as a string at first, as a list once it was changed
+    continents = ns['gdp_index'].continents()
+    return [(callback, (year, value)) for callback in ('update_figure', 'update_bar_chart')
+            for year in ns['slider_years'] for continent in continents for value in (continent, [continent])]
+
+
+def le3_jobs(ns):
+    if ns['CLIENTSIDE']:
+        return []
+    years = ns['gdp_index'].years()
+    return [('update_charts', (year, continent)) for year in np.arange(years.min(), years.max() + 1, 5)
+            for continent in ns['gdp_index'].continents()]
+
+
+def hicks_jobs(ns):
+    # a year button keeps the first continent, a continent button the first year
+    years, continents = ns['gdp_index'].years(), ns['gdp_index'].continents()
+    jobs = [('scatter_figure', (year, continents[0])) for year in years]
+    return jobs + [('scatter_figure', (years.min(), continent)) for continent in continents]
+
+
+def flight_delay_jobs(ns):
+    methods = ('minmax', 'lttb', 'pyramid') if ns['PYRAMID_AVAILABLE'] else ('minmax', 'lttb')
+    return [('update_delay_graph', (scenario, method, 'line', 'webgl', None))
+            for scenario in ns['SCENARIOS'] for method in methods]
+
+
+# dashboard: (file, jobs of its namespace, store tables the figures are rendered from)
+DASHBOARDS = {
+    'Dashboard_LE4_fast': ('Dashboard_LE4_fast.py', le4_fast_jobs, ['data_gapminder_join']),
+    'Dashboard_LE4_slow': ('Dashboard_LE4_slow', le4_slow_jobs, ['data_gapminder_join_slow']),
+    'Dashboard_le2': ('Dashboard_le2.py', le2_jobs, ['data_gapminder']),
+    'Dashboard_le3': ('Dashboard_le3.py', le3_jobs, ['data_gapminder']),
+    'Dashboard_3_hicks': ('Dashboard_3_hicks.py', hicks_jobs, ['data_gapminder']),
+    'Dashboard_flight_delay': ('Dashboard_flight_delay.py', flight_delay_jobs,
+                               ['flight_data_arr', 'pyramid_arr_day', 'pyramid_arr_hour', 'pyramid_arr_5min']),
+}
+
+
+def data_stamp(tables):
+    # content hashes, not mtimes: the export and the store may be copied to another machine
+    return [table_hash(table) for table in tables]
+
+
+def figure_key(callback, args):
+    return json.dumps([callback, [normalize(a) for a in args]], default=repr)
+
+
+def file_stem(args):
+    # readable and unique: the plain arguments plus a short hash of all of them
+    plain = [normalize(a) for a in args]
+    readable = '_'.join(str(a) for a in plain if isinstance(a, (str, int, float)))
+    digest = hashlib.sha1(json.dumps(plain, default=repr).encode()).hexdigest()[:8]
+    return f"{re.sub(r'[^A-Za-z0-9.-]+', '-', readable).strip('-')}-{digest}"
+
+
+# namespaces of the dashboards loaded in this (worker) process
+_loaded = {}
+
+
+def _dashboard(name):
+    if name not in _loaded:
+        # render through the callbacks, not from an earlier export, and without background prefetching
+        os.environ.pop('STATIC_FIGURES_DIR', None)
+        ns = runpy.run_path(os.path.join(HERE, DASHBOARDS[name][0]), run_name='prerender')
+        if 'figure_cache' in ns:
+            ns['figure_cache'].prefetch_enabled = False
+        _loaded[name] = ns
+    return _loaded[name]
+
+
+def list_jobs(name):
+    return DASHBOARDS[name][1](_dashboard(name))
+
+
+def render(name, callback, args, out, bundle, html):
+    """Run one callback, write its output as json (and html per figure), returns the manifest entry."""
+    value = _dashboard(name)[callback](*args)
+    folder = os.path.join(out, name, callback)
+    os.makedirs(folder, exist_ok=True)
+    stem = os.path.join(folder, file_stem(args))
+    with open(stem + '.json', 'w') as f:
+        json.dump(value, f, cls=plotly.utils.PlotlyJSONEncoder)
+    entry = {'callback': callback, 'args': [normalize(a) for a in args], 'json': os.path.relpath(stem + '.json', out)}
+
+    if html:
+        figures = [v for v in (value if isinstance(value, (list, tuple)) else [value]) if hasattr(v, 'to_plotly_json')]
+        if figures:
+            script = os.path.relpath(os.path.join(out, bundle), folder)
+            divs = [pio.to_html(fig, include_plotlyjs=False, full_html=False) for fig in figures]
+            with open(stem + '.html', 'w') as f:
+                f.write(f'<html><head><meta charset="utf-8"><script src="{script}"></script></head>'
+                        f'<body>{"".join(divs)}</body></html>')
+            entry['html'] = os.path.relpath(stem + '.html', out)
+    return figure_key(callback, args), entry
+
+
+def write_bundle(out):
+    """plotly.js once for all pages, named by version so browsers can cache it."""
+    bundle = f'plotly-{get_plotlyjs_version()}.min.js'
+    path = os.path.join(out, bundle)
+    if not os.path.exists(path):
+        with open(path, 'w') as f:
+            f.write(get_plotlyjs())
+    return bundle
+
+
+def export(names=None, out=EXPORT_ROOT, workers=None, html=True, log=None):
+    """Render the dashboards into out/, returns the manifest."""
+    names = list(names or DASHBOARDS)
+    os.makedirs(out, exist_ok=True)
+    bundle = write_bundle(out)
+    manifest_path = os.path.join(out, MANIFEST_FILE)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {'dashboards': {}}
+    manifest['plotlyjs'] = bundle
+
+    with ProcessPoolExecutor(workers) as pool:
+        for name in names:
+            start = time.perf_counter()
+            stamp = data_stamp(DASHBOARDS[name][2])
+            jobs = pool.submit(list_jobs, name).result()
+            futures = [pool.submit(render, name, callback, args, out, bundle, html) for callback, args in jobs]
+            figures = dict(future.result() for future in futures)
+            manifest['dashboards'][name] = {'stamp': stamp, 'figures': figures}
+            if log:
+                log(name, len(figures), time.perf_counter() - start)
+
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, manifest_path)
+    return manifest
+
+
+class StaticFigures:
+    """Serves the figures of one dashboard from an export, when STATIC_FIGURES_DIR (or root) is set."""
+
+    def __init__(self, name, root=None):
+        self.name = name
+        self.root = root if root is not None else os.environ.get('STATIC_FIGURES_DIR')
+        self.served = 0
+        self.entries = []
+        # per instance, a cache on the method would keep every instance alive
+        self._read = functools.lru_cache(maxsize=256)(self._read_file)
+        if not self.root:
+            return
+        try:
+            with open(os.path.join(self.root, MANIFEST_FILE)) as f:
+                exported = json.load(f)['dashboards'].get(name)
+        except (FileNotFoundError, ValueError, KeyError) as e:
+            logger.warning('no usable export in %s (%s), not using it', self.root, e)
+            return
+        if exported is None:
+            logger.warning('the export in %s has no figures of %s, not using it', self.root, name)
+            return
+        if exported['stamp'] != data_stamp(DASHBOARDS[name][2]):
+            logger.warning('the export of %s in %s was rendered from other data, not using it', name, self.root)
+            return
+        self.entries = list(exported['figures'].values())
+
+    def _read_file(self, path):
+        with open(os.path.join(self.root, path)) as f:
+            return json.load(f)
+
+    def prerendered(self, func=None, *, key_args=None):
+        """Decorator, returns the exported output for these arguments instead of calling func.
+
+        key_args: positions of the arguments that pick the figure (default: all of them),
+        as for FigureCache.cached.
+        """
+        if func is None:
+            return functools.partial(self.prerendered, key_args=key_args)
+
+        def key(args):
+            return figure_key(func.__name__, args if key_args is None else [args[i] for i in key_args])
+
+        figures = {key(entry['args']): entry['json'] for entry in self.entries if entry['callback'] == func.__name__}
+        if not figures:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            path = figures.get(key(args))
+            if path is None:
+                return func(*args)
+            self.served += 1
+            return self._read(path)
+
+        return wrapper
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-render the dashboard figures into static json / html')
+    parser.add_argument('dashboards', nargs='*', help=f'default: all of {", ".join(DASHBOARDS)}')
+    parser.add_argument('--out', default=EXPORT_ROOT)
+    parser.add_argument('--workers', type=int, help='processes (default: cpu count)')
+    parser.add_argument('--no-html', action='store_true', help='only the json callback outputs')
+    args = parser.parse_args()
+    unknown = set(args.dashboards) - set(DASHBOARDS)
+    if unknown:
+        parser.error(f'unknown dashboards: {", ".join(sorted(unknown))}')
+
+    manifest = export(args.dashboards, args.out, args.workers, html=not args.no_html,
+                      log=lambda name, n, seconds: print(f'{name:<24} {n:>5} figures in {seconds:.1f}s'))
+    sizes = {'json': 0, 'html': 0}
+    for exported in manifest['dashboards'].values():
+        for entry in exported['figures'].values():
+            for kind in sizes:
+                if kind in entry:
+                    sizes[kind] += os.path.getsize(os.path.join(args.out, entry[kind]))
+    bundle = os.path.getsize(os.path.join(args.out, manifest['plotlyjs']))
+    print(f"json {sizes['json'] / 1e6:.1f} MB, html {sizes['html'] / 1e6:.1f} MB, "
+          f"shared {manifest['plotlyjs']} {bundle / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
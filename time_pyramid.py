@@ -0,0 +1,116 @@
+# Multi-resolution time pyramid of the delays, built once per year by prep_pipeline.py
+#
+# For every level (day, hour, 5 minutes) the delays are bucketed by time and reduced to
+# min / max / mean / count per airport and bucket, plus one row per bucket over all
+# airports (airport ALL). The rows are sorted by bucket (time-major), so the visible
+# x range of a plot is one binary search on the bucket column; a set of airports is
+# merged per bucket with reduceat:
+#
+#   store/pyramid_arr_day/2018/, store/pyramid_arr_hour/2018/, store/pyramid_arr_5min/2018/, ...
+#
+#   levels = read_pyramid('arr')
+#   level = choose_level(x0, x1, max_buckets=2400)
+#   series = query(levels[level], x0, x1, airports=['ABE', 'ABI'])   # bucket, min, max, mean, count
+#
+# A whole year needs 365 day buckets, a week at 5 minutes 2016, so every zoom is served at
+# a constant payload size instead of plotting every flight.
+import numpy as np
+import pandas as pd
+
+from data_store import STORE_ROOT, read_table, write_partition
+from flight_rollup import ROLLUPS
+
+# finest last
+LEVELS = {'day': 'D', 'hour': 'h', '5min': '5min'}
+ALL = '*'
+
+
+def pyramid_name(direction, level):
+    return f'pyramid_{direction}_{level}'
+
+
+def bucket_width(level):
+    return pd.tseries.frequencies.to_offset(LEVELS[level]).nanos * np.timedelta64(1, 'ns')
+
+
+def build_level(flights, airport_column, time_column, delay_column, level):
+    """min, max, mean and count of delay_column per time bucket and airport, sorted by bucket."""
+    flights = flights[flights[time_column].notna()]
+    bucket = flights[time_column].dt.floor(LEVELS[level]).rename('bucket')
+    delay = flights[delay_column].astype(np.float64)
+    per_airport = delay.groupby([bucket, flights[airport_column].astype(object).rename('airport')],
+                                observed=True, sort=True).agg(['min', 'max', 'mean', 'count'])
+    overall = delay.groupby(bucket, sort=True).agg(['min', 'max', 'mean', 'count'])
+    overall.index = pd.MultiIndex.from_arrays([overall.index, np.full(len(overall), ALL)], names=['bucket', 'airport'])
+    pyramid = pd.concat([per_airport, overall]).reset_index()
+    pyramid = pyramid.sort_values('bucket', kind='stable', ignore_index=True)
+    pyramid['airport'] = pyramid['airport'].astype('category')
+    pyramid['count'] = pyramid['count'].astype(np.int32)
+    return pyramid[['bucket', 'airport', 'min', 'max', 'mean', 'count']]
+
+
+def write_pyramid(year, frames, root=STORE_ROOT):
+    """Write every level of one year. frames: {'arr': flight_data_arr, 'dep': flight_data_dep}."""
+    for direction, flights in frames.items():
+        airport_column, time_column, delay_column, _ = ROLLUPS[direction]
+        for level in LEVELS:
+            write_partition(build_level(flights, airport_column, time_column, delay_column, level),
+                            pyramid_name(direction, level), year, root=root)
+
+
+def read_pyramid(direction='arr', years=None, root=STORE_ROOT):
+    """{level: table} of the stored years, sorted by bucket."""
+    levels = {}
+    for level in LEVELS:
+        table = read_table(pyramid_name(direction, level), partitions=years, root=root)
+        # late arrivals of one year's file fall into the first buckets of the next year
+        if not table['bucket'].is_monotonic_increasing:
+            table = table.sort_values('bucket', kind='stable', ignore_index=True)
+        levels[level] = table
+    return levels
+
+
+def choose_level(x0=None, x1=None, max_buckets=2400, extent=None):
+    """The finest level with at most max_buckets buckets between x0 and x1.
+
+    An open end is taken from extent (first, last bucket of the data), the coarsest level
+    is used when no level fits.
+    """
+    start = np.datetime64(pd.Timestamp(x0 if x0 is not None else extent[0]))
+    end = np.datetime64(pd.Timestamp(x1 if x1 is not None else extent[1]))
+    for level in reversed(LEVELS):
+        if (end - start) / bucket_width(level) <= max_buckets:
+            return level
+    return next(iter(LEVELS))
+
+
+def query(table, x0=None, x1=None, airports=None):
+    """bucket, min, max, mean, count between x0 and x1, over all airports or merged over `airports`."""
+    buckets = table['bucket'].to_numpy()
+    start = 0 if x0 is None else np.searchsorted(buckets, np.datetime64(pd.Timestamp(x0)), side='left')
+    end = len(buckets) if x1 is None else np.searchsorted(buckets, np.datetime64(pd.Timestamp(x1)), side='right')
+    codes = table['airport'].cat.codes.to_numpy()[start:end]
+    wanted = table['airport'].cat.categories.get_indexer([ALL] if airports is None else list(airports))
+    mask = np.isin(codes, wanted[wanted >= 0])
+
+    def column(name):
+        return table[name].to_numpy()[start:end][mask]
+
+    buckets, mins, maxs = column('bucket'), column('min'), column('max')
+    counts = column('count').astype(np.int64)
+    sums = np.where(counts > 0, column('mean') * counts, 0.0)
+    if not len(buckets):
+        return pd.DataFrame({'bucket': buckets, 'min': mins, 'max': maxs, 'mean': sums, 'count': counts})
+
+    # rows of one bucket are adjacent, merge them
+    firsts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    count = np.add.reduceat(counts, firsts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.add.reduceat(sums, firsts) / count
+    return pd.DataFrame({
+        'bucket': buckets[firsts],
+        'min': np.fmin.reduceat(mins, firsts),
+        'max': np.fmax.reduceat(maxs, firsts),
+        'mean': np.where(count > 0, mean, np.nan),
+        'count': count,
+    })